@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import argparse
+
+from dbkit_package.DBKit import createShardIndex
+
+
+def main(args):
+    logFile = open(args.log, "w")
+    logFile.write("Combining %s shard(s).\n" % len(args.index))
+    for shard, shardIndex in enumerate(args.index):
+        logFile.write("Shard %s: %s.\n" % (shard, shardIndex))
+    count = createShardIndex(args.index, args.output)
+    logFile.write("Combined %s entries.\n" % count)
+    logFile.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='DBKit - Combine shard indices into a single routing index.')
+    parser.add_argument('-i', '--index', help='Shard Index files (ffindex) in shard order', nargs='+', required=True)
+    parser.add_argument('-o', '--output', help='Combined Index file', required=True)
+    parser.add_argument('-g', '--log', help='Log file', required=True)
+    args = parser.parse_args()
+    main(args)
@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os import remove
-from os.path import getsize, isfile
+from os.path import isfile
+from time import perf_counter
+from urllib.request import urlopen
 
-from dbkit_package.DBKit import writeEntry
-
-try:
-    import wget
-except Exception:
-    wget = None
+from dbkit_package.DBKit import DBKitWriter, getShard, recoverDatabase
 
 
 def getIdentifiers(args):
@@ -31,30 +30,86 @@ def getIdentifiers(args):
     return sorted(entries)
 
 
+def loadEntry(args, entryId):
+    startTime = perf_counter()
+    content = None
+    if args.url:
+        fileName = "%s%s" % (args.url, entryId)
+        try:
+            with urlopen(fileName) as response:
+                content = response.read()
+        except Exception:
+            content = None
+    else:
+        pathName = args.path.rstrip("/")
+        fileName = "%s/%s" % (pathName, entryId)
+        if isfile(fileName):
+            with open(fileName, "rb") as file:
+                content = file.read()
+    return fileName, content, perf_counter() - startTime
+
+
+def loadEntries(args, entries):
+    threads = max(1, int(args.threads))
+    if threads == 1:
+        for entryId in entries:
+            yield entryId, loadEntry(args, entryId)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = deque()
+            entryIterator = iter(entries)
+            for entryId in entryIterator:
+                pending.append((entryId, executor.submit(loadEntry, args, entryId)))
+                if len(pending) >= 2 * threads:
+                    break
+            while pending:
+                entryId, future = pending.popleft()
+                nextId = next(entryIterator, None)
+                if nextId is not None:
+                    pending.append((nextId, executor.submit(loadEntry, args, nextId)))
+                yield entryId, future.result()
+
+
+def getRate(size, seconds):
+    if seconds > 0:
+        return size / seconds / 1e6
+    return 0.0
+
+
 def main(args):
     entries = getIdentifiers(args)
     logFile = open(args.log, "w")
     logFile.write("Found %s entries.\n" % len(entries))
+    if args.shards > 1:
+        entries = [entryId for entryId in entries if getShard(entryId, args.shards) == args.shard]
+        logFile.write("Selected %s entries for shard %s of %s.\n" % (len(entries), args.shard, args.shards))
     outputIndex = args.index
     outputDatabase = args.database
-    if isfile(outputDatabase):
-        remove(outputDatabase)
-    for entryId in entries:
-        logFile.write("Loading %s.\n" % entryId)
-        if args.url:
-            fileName = wget.download("%s%s" % (args.url, entryId))
-        else:
-            pathName = args.path.rstrip("/")
-            fileName = "%s/%s" % (pathName, entryId)
-        if isfile(fileName):
-            entrySize = getsize(fileName)
-            if entrySize == 0:
+    if args.append:
+        existingEntries = recoverDatabase(outputIndex, outputDatabase)
+        logFile.write("Found %s existing entries.\n" % len(existingEntries))
+        entries = [entryId for entryId in entries if entryId not in existingEntries]
+        logFile.write("Appending %s new entries.\n" % len(entries))
+    else:
+        for fileName in [outputIndex, outputDatabase]:
+            if isfile(fileName):
+                remove(fileName)
+    startTime = perf_counter()
+    totalSize = 0
+    with DBKitWriter(outputIndex, outputDatabase) as writer:
+        for entryId, [fileName, content, loadTime] in loadEntries(args, entries):
+            logFile.write("Loading %s.\n" % entryId)
+            if content is None:
+                logFile.write("Content not found: %s.\n" % fileName)
+            elif len(content) == 0:
                 logFile.write("Entry `%s` not found.\n" % entryId)
             else:
-                writeEntry(entryId, fileName, outputIndex, outputDatabase)
-        else:
-            logFile.write("Content not found: %s.\n" % fileName)
-        logFile.flush()
+                writer.writeContent(entryId, content)
+                totalSize = totalSize + len(content)
+                logFile.write("Loaded %s [%d bytes, %.2f MB/s].\n" % (entryId, len(content), getRate(len(content), loadTime)))
+            logFile.flush()
+    totalTime = perf_counter() - startTime
+    logFile.write("Completed %s entries [%d bytes, %.2f MB/s].\n" % (len(entries), totalSize, getRate(totalSize, totalTime)))
     logFile.close()
 
 
@@ -70,5 +125,9 @@ if __name__ == "__main__":
     parser.add_argument('-o', '--index', help='Output Database Index', required=True)
     parser.add_argument('-d', '--database', help='Output Database', required=True)
     parser.add_argument('-g', '--log', help="Log file", required=True)
+    parser.add_argument('-a', '--append', '--update', help="Append new entries to an existing database", action="store_true", default=False)
+    parser.add_argument('-ns', '--shards', help="Total number of database shards", type=int, required=False, default=1)
+    parser.add_argument('-s', '--shard', help="Shard to be built (0 to shards - 1)", type=int, required=False, default=0)
+    parser.add_argument('-t', '--threads', help="Number of concurrent loaders", type=int, required=False, default=1)
     args = parser.parse_args()
     main(args)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import argparse
 
-from dbkit_package.DBKit import DBKit, writeEntry
+from dbkit_package.DBKit import DBKit, DBKitWriter
 
 
 def main(args):
@@ -14,16 +14,23 @@ def main(args):
             name = line.split()[0]
             entries.append(name)
     logFile.write("Detected %s entries.\n" % len(entries))
-    fileName = "temp.dat"
     count = 0
     dbkit = DBKit(args.index, args.database)
-    for entry in sorted(entries):
-        success = dbkit.createFile(entry, fileName)
-        if success:
-            writeEntry(entry, fileName, outputIndex, outputDatabase)
-            count = count + 1
-        else:
-            logFile.write("Entry %s not found.\n" % entry)
+    with DBKitWriter(outputIndex, outputDatabase) as writer:
+        copies = dict()
+        for entry in sorted(entries):
+            location = dbkit.index.getLocation(entry)
+            if location is not None:
+                shard, start, size = location
+                targetStart = writer.reserve(entry, size)
+                if targetStart is not None:
+                    copies.setdefault(shard, list()).append((start, size, targetStart))
+                count = count + 1
+            else:
+                logFile.write("Entry %s not found.\n" % entry)
+        for shard in sorted(copies):
+            with open(dbkit.getDatabaseFile(shard), "rb") as file:
+                writer.copyRanges(file.fileno(), copies[shard], threads=args.threads)
     logFile.write("Extracted %s entries.\n" % count)
     logFile.close()
 
@@ -32,9 +39,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='DBKit - Merge database pair.')
     parser.add_argument('-l', '--list', help='List of entries to be extracted', required=True)
     parser.add_argument('-i', '--index', help='Database Index file (ffindex)', required=True)
-    parser.add_argument('-d', '--database', help='Database Data file (ffdata)', required=True)
+    parser.add_argument('-d', '--database', help='Database Data file(s) (ffdata), one per shard', nargs='+', required=True)
     parser.add_argument('-oi', '--outputindex', help='Output Index file', required=True)
     parser.add_argument('-od', '--outputdatabase', help='Output Data file', required=True)
     parser.add_argument('-g', '--log', help='Log file', required=True)
+    parser.add_argument('-t', '--threads', help='Number of parallel readers', type=int, default=1, required=False)
     args = parser.parse_args()
     main(args)
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 import argparse
 from os.path import getsize
-from shutil import copyfile
 
-from dbkit_package.DBKit import DBKit, writeEntry
+from dbkit_package.DBKit import DBKitIndex, DBKitWriter
+
+
+def checkShards(entries, databaseFiles, indexFile):
+    if entries.getShardCount() > len(databaseFiles):
+        raise Exception("Index refers to %s shards but %s data file(s) were given: %s." % (entries.getShardCount(), len(databaseFiles), indexFile))
 
 
 def main(args):
@@ -20,29 +24,33 @@ def main(args):
         firstData = args.seconddata
         secondIndex = args.firstindex
         secondData = args.firstdata
-    copyfile(firstIndex, outputIndex)
-    copyfile(firstData, outputDatabase)
-    firstEntries = set()
-    with open(firstIndex, "r") as f:
-        for line in f:
-            name = line.split()[0]
-            firstEntries.add(name)
+    firstEntries = DBKitIndex(firstIndex)
+    checkShards(firstEntries, firstData, firstIndex)
     logFile.write("Detected %s entries.\n" % len(firstEntries))
-    secondEntries = list()
-    with open(secondIndex, "r") as f:
-        for line in f:
-            name = line.split()[0]
-            secondEntries.append(name)
-    fileName = "temp.dat"
+    secondEntries = DBKitIndex(secondIndex)
+    checkShards(secondEntries, secondData, secondIndex)
     count = 0
-    dbkit = DBKit(secondIndex, secondData)
-    for secondKey in secondEntries:
-        if secondKey not in firstEntries:
-            dbkit.createFile(secondKey, fileName)
-            writeEntry(secondKey, fileName, outputIndex, outputDatabase)
-            count = count + 1
-        else:
-            logFile.write("Skipping existing entry %s.\n" % secondKey)
+    with DBKitWriter(outputIndex, outputDatabase, append=False, sortIndex=True) as writer:
+        firstStarts = list()
+        for fileName in firstData:
+            firstSize = getsize(fileName)
+            firstStarts.append(writer.reserve(None, firstSize))
+            with open(fileName, "rb") as firstFile:
+                writer.copyRange(firstFile.fileno(), 0, firstSize, firstStarts[-1])
+        for firstKey, (shard, start, size) in firstEntries.locations():
+            writer.addIndexEntry(firstKey, firstStarts[shard] + start, size)
+        copies = dict()
+        for secondKey, (shard, start, size) in secondEntries.locations():
+            if secondKey not in firstEntries:
+                targetStart = writer.reserve(secondKey, size)
+                if targetStart is not None:
+                    copies.setdefault(shard, list()).append((start, size, targetStart))
+                count = count + 1
+            else:
+                logFile.write("Skipping existing entry %s.\n" % secondKey)
+        for shard in sorted(copies):
+            with open(secondData[shard], "rb") as secondFile:
+                writer.copyRanges(secondFile.fileno(), copies[shard])
     logFile.write("Added %s entries.\n" % count)
     logFile.close()
 
@@ -50,9 +58,9 @@ def main(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='DBKit - Merge database pair.')
     parser.add_argument('-i', '--firstindex', help='First Index file', required=True)
-    parser.add_argument('-d', '--firstdata', help='First Data file', required=True)
+    parser.add_argument('-d', '--firstdata', help='First Data file(s), one per shard', nargs='+', required=True)
     parser.add_argument('-si', '--secondindex', help='Second Index file', required=True)
-    parser.add_argument('-sd', '--seconddata', help='Second Data file', required=True)
+    parser.add_argument('-sd', '--seconddata', help='Second Data file(s), one per shard', nargs='+', required=True)
     parser.add_argument('-oi', '--outputindex', help='Output Index file', required=True)
     parser.add_argument('-od', '--outputdatabase', help='Output Data file', required=True)
     parser.add_argument('-log', '--log', help='Log file', required=True)
@@ -1,32 +1,223 @@
-from os.path import getsize, isfile
+import errno
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from os import SEEK_END, chmod, remove, replace, stat
+from os.path import abspath, basename, dirname, getsize, isfile
 
+INDEX_MAGIC = b"DBKI"
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct("=4sIQQq")
+CHUNK_SIZE = 1 << 20
+READ_GAP = 1 << 16
+READ_SIZE = 1 << 26
+COPY_FALLBACK = [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF]
 
-class DBKit:
-    def __init__(self, indexFile, databaseFile):
-        self.databaseFile = databaseFile
-        self.index = dict()
-        with open(indexFile) as file:
+
+class DBKitIndex:
+    def __init__(self, indexFile, cacheFile=None):
+        self.indexFile = indexFile
+        self.cacheFile = cacheFile if cacheFile is not None else "%s.bin" % indexFile
+        self.buffer = None
+        self.view = None
+        indexStat = stat(indexFile)
+        if not self.loadCache(indexStat):
+            content = self.createCache(indexStat)
+            self.view = memoryview(content)
+            try:
+                self.writeCache(content)
+            except OSError:
+                pass
+        self.setArrays()
+
+    def loadCache(self, indexStat):
+        if not isfile(self.cacheFile) or getsize(self.cacheFile) < INDEX_HEADER.size:
+            return False
+        try:
+            with open(self.cacheFile, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, version, count, size, mtime = INDEX_HEADER.unpack_from(buffer)
+        if (magic != INDEX_MAGIC or version != INDEX_VERSION
+           or size != indexStat.st_size or mtime != indexStat.st_mtime_ns
+           or len(buffer) != getCacheSize(buffer, count)):
+            buffer.close()
+            return False
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        return True
+
+    def createCache(self, indexStat):
+        entries = dict()
+        with open(self.indexFile) as file:
             for line in file:
                 cols = line.split()
                 try:
                     identifier = cols[0]
                     start = int(cols[1])
                     size = int(cols[2])
-                    self.index[identifier] = [start, size]
+                    shard = int(cols[3]) if len(cols) > 3 else 0
+                    entries[identifier.encode()] = (start, size, shard)
                 except Exception:
                     raise Exception("Invalid DBKit Index file format: %s." % line)
+        names = sorted(entries.keys())
+        starts = array("Q", [entries[name][0] for name in names])
+        sizes = array("Q", [entries[name][1] for name in names])
+        shards = array("I", [entries[name][2] for name in names])
+        nameOffsets = array("Q", [0])
+        for name in names:
+            nameOffsets.append(nameOffsets[-1] + len(name))
+        header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(names), indexStat.st_size, indexStat.st_mtime_ns)
+        return b"".join([header, starts.tobytes(), sizes.tobytes(), nameOffsets.tobytes(), shards.tobytes(), b"".join(names)])
+
+    def writeCache(self, content):
+        tempHandle, tempFile = tempfile.mkstemp(prefix="%s." % basename(self.cacheFile), suffix=".tmp",
+                                                dir=dirname(abspath(self.cacheFile)))
+        try:
+            with open(tempHandle, "wb") as file:
+                file.write(content)
+            chmod(tempFile, 0o644)
+            replace(tempFile, self.cacheFile)
+        except OSError:
+            if isfile(tempFile):
+                remove(tempFile)
+            raise
+
+    def setArrays(self):
+        self.count = INDEX_HEADER.unpack_from(self.view)[2]
+        offset = INDEX_HEADER.size
+        width = 8 * self.count
+        self.starts = self.view[offset:offset + width].cast("Q")
+        offset = offset + width
+        self.sizes = self.view[offset:offset + width].cast("Q")
+        offset = offset + width
+        self.nameOffsets = self.view[offset:offset + width + 8].cast("Q")
+        offset = offset + width + 8
+        self.shards = self.view[offset:offset + 4 * self.count].cast("I")
+        offset = offset + 4 * self.count
+        self.names = self.view[offset:]
+
+    def getName(self, position):
+        return bytes(self.names[self.nameOffsets[position]:self.nameOffsets[position + 1]])
+
+    def getPosition(self, identifier):
+        key = identifier.encode()
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.getName(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.getName(low) == key:
+            return low
+        return None
+
+    def get(self, identifier, default=None):
+        position = self.getPosition(identifier)
+        if position is None:
+            return default
+        self.checkShard(position)
+        return [self.starts[position], self.sizes[position]]
+
+    def checkShard(self, position):
+        if self.shards[position] != 0:
+            raise Exception("DBKit entry is located in shard %s, use getLocation: %s." % (self.shards[position], self.getName(position).decode()))
+
+    def getShardCount(self):
+        if self.count == 0:
+            return 0
+        return max(self.shards) + 1
+
+    def getLocation(self, identifier):
+        position = self.getPosition(identifier)
+        if position is None:
+            return None
+        return self.shards[position], self.starts[position], self.sizes[position]
+
+    def close(self):
+        for view in [self.starts, self.sizes, self.nameOffsets, self.shards, self.names, self.view]:
+            view.release()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, identifier):
+        entry = self.get(identifier)
+        if entry is None:
+            raise KeyError(identifier)
+        return entry
+
+    def __contains__(self, identifier):
+        return self.getPosition(identifier) is not None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self.getName(position).decode()
+
+    def items(self):
+        for position in range(self.count):
+            self.checkShard(position)
+            yield self.getName(position).decode(), [self.starts[position], self.sizes[position]]
+
+    def locations(self):
+        for position in range(self.count):
+            yield self.getName(position).decode(), (self.shards[position], self.starts[position], self.sizes[position])
+
+
+def getCacheSize(buffer, count):
+    offsetsEnd = INDEX_HEADER.size + 24 * count + 8
+    if len(buffer) < offsetsEnd:
+        return None
+    namesSize = struct.unpack_from("=Q", buffer, offsetsEnd - 8)[0]
+    return offsetsEnd + 4 * count + namesSize
+
+
+class DBKit:
+    def __init__(self, indexFile, databaseFile):
+        self.databaseFiles = getDatabaseFiles(databaseFile)
+        self.databaseFile = self.databaseFiles[0]
+        self.index = DBKitIndex(indexFile)
+
+    def getDatabaseFile(self, shard=0):
+        if shard >= len(self.databaseFiles):
+            raise Exception("DBKit shard not found: %s." % shard)
+        return self.databaseFiles[shard]
+
+    def getChunks(self, identifier):
+        location = self.index.getLocation(identifier)
+        if location is None:
+            return None
+        shard, start, size = location
+        return self.readChunks(start, size, shard)
+
+    def readChunks(self, start, size, shard=0):
+        databaseFile = self.getDatabaseFile(shard)
+        with open(databaseFile, "rb") as file:
+            file.seek(start)
+            while size > 0:
+                chunk = file.read(min(size, CHUNK_SIZE))
+                if not chunk:
+                    raise Exception("DBKit entry exceeds database size: %s." % databaseFile)
+                size = size - len(chunk)
+                yield chunk
 
     def createFile(self, identifier, outputName):
-        if identifier in self.index:
-            entry = self.index[identifier]
-            start = entry[0]
-            size = entry[1]
-            with open(self.databaseFile, "rb") as file:
-                file.seek(start)
-                content = file.read(size)
-                outputFile = open(outputName, "wb")
-                outputFile.write(content)
-                outputFile.close()
+        chunks = self.getChunks(identifier)
+        if chunks is not None:
+            with open(outputName, "wb") as outputFile:
+                for chunk in chunks:
+                    outputFile.write(chunk)
             return True
         else:
             return False
@@ -35,24 +226,236 @@ class DBKit:
         return self.index
 
 
-def writeEntry(identifier, fileName, outputIndex, outputDatabase):
-    if isfile(outputDatabase):
-        currentSize = getsize(outputDatabase)
-    else:
-        currentSize = 0
-    if isfile(fileName):
-        entrySize = getsize(fileName)
-    else:
-        entrySize = 0
-    if entrySize > 0:
-        outputIndexFile = open(outputIndex, "a+")
-        outputIndexFile.write("%s\t%s\t%s\n" % (identifier, currentSize, entrySize))
-        tempFile = open(fileName, "rb")
-        databaseFile = open(outputDatabase, "ab+")
-        databaseFile.write(tempFile.read())
-        databaseFile.close()
-        tempFile.close()
-        outputIndexFile.close()
+class DBKitWriter:
+    def __init__(self, outputIndex, outputDatabase, bufferSize=1024, append=True, sortIndex=False):
+        self.outputIndex = outputIndex
+        self.outputDatabase = outputDatabase
+        self.bufferSize = bufferSize
+        self.append = append
+        self.sortIndex = sortIndex
+        self.indexFile = None
+        self.databaseFile = None
+        self.indexLines = list()
+        self.offset = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def open(self):
+        flags = os.O_RDWR | os.O_CREAT
+        if not self.append:
+            flags = flags | os.O_TRUNC
+        self.databaseFile = open(os.open(self.outputDatabase, flags, 0o666), "r+b")
+        self.offset = self.databaseFile.seek(0, SEEK_END)
+        self.indexFile = open(self.outputIndex, "a" if self.append else "w")
+
+    def writeEntry(self, identifier, fileName):
+        if not isfile(fileName):
+            return False
+        with open(fileName, "rb") as file:
+            return self.writeChunks(identifier, iter(lambda: file.read(CHUNK_SIZE), b""))
+
+    def writeContent(self, identifier, content):
+        return self.writeChunks(identifier, [content])
+
+    def writeChunks(self, identifier, chunks):
+        size = 0
+        for chunk in chunks:
+            self.databaseFile.write(chunk)
+            size = size + len(chunk)
+        return self.addEntry(identifier, size)
+
+    def addEntry(self, identifier, size, flush=True):
+        if size == 0:
+            return False
+        self.addIndexEntry(identifier, self.offset, size, flush=flush)
+        self.offset = self.offset + size
         return True
+
+    def addIndexEntry(self, identifier, start, size, flush=True):
+        self.indexLines.append((identifier, start, size))
+        if flush and not self.sortIndex and len(self.indexLines) >= self.bufferSize:
+            self.flush()
+
+    def reserve(self, identifier, size):
+        start = self.offset
+        if identifier is None:
+            self.offset = self.offset + size
+        elif not self.addEntry(identifier, size, flush=False):
+            return None
+        return start
+
+    def copyRange(self, sourceFd, sourceStart, size, targetStart):
+        self.databaseFile.flush()
+        copyRange(sourceFd, self.databaseFile.fileno(), sourceStart, size, targetStart)
+
+    def copyRanges(self, sourceFd, copies, threads=1):
+        self.databaseFile.flush()
+        targetFd = self.databaseFile.fileno()
+        groups = getGroups(getRanges(copies))
+        if threads > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(lambda group: copyGroup(sourceFd, targetFd, group), groups))
+        else:
+            for group in groups:
+                copyGroup(sourceFd, targetFd, group)
+        if not self.sortIndex:
+            self.flush()
+
+    def flush(self):
+        self.databaseFile.flush()
+        if self.sortIndex:
+            self.indexLines.sort()
+        self.indexFile.write("".join(["%s\t%s\t%s\n" % line for line in self.indexLines]))
+        self.indexFile.flush()
+        self.indexLines = list()
+
+    def close(self):
+        if self.databaseFile is not None:
+            self.flush()
+            self.databaseFile.close()
+            self.indexFile.close()
+            self.databaseFile = None
+            self.indexFile = None
+
+
+def copyRange(sourceFd, targetFd, sourceStart, size, targetStart):
+    while size > 0:
+        copied = copyChunk(sourceFd, targetFd, sourceStart, size, targetStart)
+        if copied == 0:
+            raise Exception("DBKit copy exceeds source size [%s, %s]." % (sourceStart, size))
+        sourceStart = sourceStart + copied
+        targetStart = targetStart + copied
+        size = size - copied
+
+
+def copyChunk(sourceFd, targetFd, sourceStart, size, targetStart):
+    if hasattr(os, "copy_file_range"):
+        try:
+            return os.copy_file_range(sourceFd, targetFd, size, sourceStart, targetStart)
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK:
+                raise
+    content = os.pread(sourceFd, min(size, CHUNK_SIZE), sourceStart)
+    writeAt(targetFd, content, targetStart)
+    return len(content)
+
+
+def writeAt(targetFd, content, targetStart):
+    written = 0
+    while written < len(content):
+        written = written + os.pwrite(targetFd, content[written:], targetStart + written)
+
+
+def readAt(sourceFd, size, sourceStart):
+    content = bytearray()
+    while len(content) < size:
+        chunk = os.pread(sourceFd, size - len(content), sourceStart + len(content))
+        if not chunk:
+            raise Exception("DBKit copy exceeds source size [%s, %s]." % (sourceStart, size))
+        content.extend(chunk)
+    return memoryview(content)
+
+
+def getRanges(copies):
+    ranges = list()
+    for sourceStart, size, targetStart in sorted(copies):
+        if ranges:
+            lastSource, lastSize, lastTarget = ranges[-1]
+            if lastSource + lastSize == sourceStart and lastTarget + lastSize == targetStart:
+                ranges[-1] = (lastSource, lastSize + size, lastTarget)
+                continue
+        ranges.append((sourceStart, size, targetStart))
+    return ranges
+
+
+def getGroups(ranges):
+    groups = list()
+    for sourceStart, size, targetStart in ranges:
+        if groups:
+            groupStart, groupSize, pieces = groups[-1]
+            groupEnd = groupStart + groupSize
+            if sourceStart - groupEnd <= READ_GAP and sourceStart + size - groupStart <= READ_SIZE:
+                pieces.append((sourceStart, size, targetStart))
+                groups[-1] = (groupStart, max(groupEnd, sourceStart + size) - groupStart, pieces)
+                continue
+        groups.append((sourceStart, size, [(sourceStart, size, targetStart)]))
+    return groups
+
+
+def copyGroup(sourceFd, targetFd, group):
+    groupStart, groupSize, pieces = group
+    if len(pieces) == 1:
+        sourceStart, size, targetStart = pieces[0]
+        copyRange(sourceFd, targetFd, sourceStart, size, targetStart)
     else:
-        return False
+        content = readAt(sourceFd, groupSize, groupStart)
+        for sourceStart, size, targetStart in pieces:
+            offset = sourceStart - groupStart
+            writeAt(targetFd, content[offset:offset + size], targetStart)
+
+
+def recoverDatabase(outputIndex, outputDatabase):
+    entries = set()
+    databaseSize = getsize(outputDatabase) if isfile(outputDatabase) else 0
+    indexSize = 0
+    databaseEnd = 0
+    if isfile(outputIndex):
+        with open(outputIndex, "rb") as file:
+            for line in file:
+                cols = line.split()
+                try:
+                    identifier = cols[0].decode()
+                    start = int(cols[1])
+                    size = int(cols[2])
+                except Exception:
+                    break
+                if not line.endswith(b"\n") or start + size > databaseSize:
+                    break
+                entries.add(identifier)
+                indexSize = indexSize + len(line)
+                databaseEnd = max(databaseEnd, start + size)
+        os.truncate(outputIndex, indexSize)
+    if isfile(outputDatabase):
+        os.truncate(outputDatabase, databaseEnd)
+    return entries
+
+
+def getDatabaseFiles(databaseFile):
+    if isinstance(databaseFile, str):
+        return [databaseFile]
+    return list(databaseFile)
+
+
+def getShard(identifier, shards):
+    return zlib.crc32(identifier.encode()) % shards
+
+
+def createShardIndex(shardIndexFiles, outputIndex):
+    shardIndices = [DBKitIndex(shardIndexFile) for shardIndexFile in shardIndexFiles]
+    for shardIndexFile, shardIndex in zip(shardIndexFiles, shardIndices):
+        if shardIndex.getShardCount() > 1:
+            raise Exception("Shard index is already a combined index: %s." % shardIndexFile)
+    shardEntries = [getShardEntries(shardIndex, shard) for shard, shardIndex in enumerate(shardIndices)]
+    count = 0
+    with open(outputIndex, "w") as file:
+        for identifier, shard, start, size in heapq.merge(*shardEntries):
+            file.write("%s\t%s\t%s\t%s\n" % (identifier, start, size, shard))
+            count = count + 1
+    for shardIndex in shardIndices:
+        shardIndex.close()
+    return count
+
+
+def getShardEntries(shardIndex, shard):
+    for identifier, [start, size] in shardIndex.items():
+        yield identifier, shard, start, size
+
+
+def writeEntry(identifier, fileName, outputIndex, outputDatabase):
+    with DBKitWriter(outputIndex, outputDatabase) as writer:
+        return writer.writeEntry(identifier, fileName)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from io import StringIO
+
+from spring_package.DBKit import DBKit
+from spring_package.Molecule import Molecule
+
+
+def getContents(args):
+    contents = list()
+    pdbDatabase = DBKit(args.index, args.database, cacheSize=0)
+    for identifier in pdbDatabase.index:
+        if args.zipped:
+            suffix = ".%s" % args.zipped
+            if not identifier.endswith(suffix):
+                continue
+            content = pdbDatabase.getBytes(identifier[:-len(suffix)], zipped=args.zipped)
+        else:
+            content = pdbDatabase.getBytes(identifier)
+        contents.append(content)
+        if args.limit and len(contents) >= args.limit:
+            break
+    pdbDatabase.close()
+    return contents
+
+
+def parseLines(content):
+    molecule = Molecule()
+    molecule.fromLines(StringIO(content.decode(), newline=None))
+
+
+def parseBytes(content):
+    molecule = Molecule()
+    molecule.fromBytes(content)
+
+
+def getThroughput(parser, contents, repeats):
+    totalSize = sum(map(len, contents)) * repeats
+    failed = 0
+    startTime = time.perf_counter()
+    for i in range(repeats):
+        for content in contents:
+            try:
+                parser(content)
+            except Exception:
+                failed = failed + 1
+    seconds = time.perf_counter() - startTime
+    return totalSize / max(seconds, 1e-9) / (1 << 20), seconds, failed
+
+
+def main(args):
+    contents = getContents(args)
+    print("Loaded %d entries [%d bytes]." % (len(contents), sum(map(len, contents))))
+    results = dict()
+    for name, parser in [("lines", parseLines), ("bytes", parseBytes)]:
+        rate, seconds, failed = getThroughput(parser, contents, args.repeats)
+        results[name] = rate
+        print("Parser %s: %.2f MB/s [%.2f s, %d failed]." % (name, rate, seconds, failed))
+    print("Speedup: %.2fx." % (results["bytes"] / max(results["lines"], 1e-9)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark PDB parsing throughput.')
+    parser.add_argument('-i', '--index', help='PDB Database Index file (ffindex)', required=True)
+    parser.add_argument('-d', '--database', help='PDB Database files (ffdata), one per shard', nargs='+', required=True)
+    parser.add_argument('-z', '--zipped', help="Zipped extension in PDB Database", required=False, default="")
+    parser.add_argument('-n', '--limit', help='Maximum number of entries', type=int, default=0)
+    parser.add_argument('-r', '--repeats', help='Number of repeats', type=int, default=3)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import argparse
+
+from spring_package.DBKit import DBKit
+from spring_package.Molecule import Molecule
+
+
+def main(args):
+    logFile = open(args.log, "w")
+    pdbDatabase = DBKit(args.index, args.database, cacheSize=0)
+    suffix = ".%s" % args.zipped if args.zipped else ""
+    entryCount = 0
+    with open(args.output_index, "w") as outputIndex, open(args.output_database, "wb") as outputDatabase:
+        for identifier in pdbDatabase.index:
+            if not identifier.endswith(suffix):
+                continue
+            pdbDatabaseId = identifier[:len(identifier) - len(suffix)]
+            content = pdbDatabase.getBytes(pdbDatabaseId, zipped=args.zipped)
+            try:
+                mol = Molecule()
+                mol.fromBytes(content, calphaOnly=True)
+                record = mol.toBinary()
+            except Exception as e:
+                logFile.write("Warning: Skipping entry '%s'. %s.\n" % (pdbDatabaseId, str(e)))
+                continue
+            outputIndex.write("%s\t%d\t%d\n" % (pdbDatabaseId, outputDatabase.tell(), len(record)))
+            outputDatabase.write(record)
+            entryCount = entryCount + 1
+    pdbDatabase.close()
+    logFile.write("Compiled %s entries.\n" % entryCount)
+    logFile.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compiles a PDB Database into a binary C-alpha template library.')
+    parser.add_argument('-i', '--index', help='PDB Database Index file (ffindex)', required=True)
+    parser.add_argument('-d', '--database', help='PDB Database files (ffdata), one per shard', nargs='+', required=True)
+    parser.add_argument('-z', '--zipped', help="Zipped extension in PDB Database", required=False, default="")
+    parser.add_argument('-oi', '--output_index', help='Output template library index file (ffindex)', required=True)
+    parser.add_argument('-od', '--output_database', help='Output template library database file (ffdata)', required=True)
+    parser.add_argument('-g', '--log', help='Log File', required=True)
+    args = parser.parse_args()
+    main(args)
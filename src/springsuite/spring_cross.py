@@ -1,82 +1,236 @@
 #!/usr/bin/env python3
 import argparse
-from os import mkdir
-from os.path import isdir
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 from spring_package.DBKit import DBKit
+from spring_package.Grid import Grid, getContacts
 from spring_package.Molecule import Molecule
 from spring_package.Utilities import getName
 
+WORKER = dict()
+
+
+def getInterfaces(mol, distance=10.0, contacts=5):
+    chainNames = list(mol.calpha.keys())
+    coordinates = [mol.getCoordinates(chainName) for chainName in chainNames]
+    labels = [np.full(len(chainCoordinates), index) for index, chainCoordinates in enumerate(coordinates)]
+    if not coordinates:
+        return set()
+    counts = getContacts(np.concatenate(coordinates), np.concatenate(labels), distance)
+    return {(chainNames[labelA], chainNames[labelB]) for (labelA, labelB), count in counts.items() if count >= contacts}
+
+
+def getInterfaceRecord(mol, chainA, chainB, distance=10.0):
+    grid = Grid(mol.getCoordinates(chainB), distance)
+    pointIndices, gridIndices, _ = grid.getPairs(mol.getCoordinates(chainA), distance)
+    residuesA = mol.calpha[chainA].residueNumbers[np.unique(pointIndices)].tolist()
+    residuesB = mol.calpha[chainB].residueNumbers[np.unique(gridIndices)].tolist()
+    return len(pointIndices), ",".join(map(str, residuesA)), ",".join(map(str, residuesB))
+
+
+def processEntry(pdb, pdbDatabase, zipped, interfaceIndex=False):
+    partnerList = set()
+    logLines = list()
+    interfaceLines = list()
+    pdbDatabaseId = "pdb%s.ent" % pdb
+    content = pdbDatabase.getBytes(pdbDatabaseId, zipped=zipped)
+    try:
+        if content is None:
+            raise Exception("Entry not found in database")
+        mol = Molecule()
+        mol.readHeader(content)
+        if not mol.hasMultipleChains():
+            logLines.append("Skipping: Single chain entry [%s].\n" % pdb)
+            return partnerList, logLines, interfaceLines
+        mol.readAtoms(calphaOnly=True)
+    except Exception as e:
+        logLines.append("Warning: Entry '%s' not found. %s.\n" % (pdbDatabaseId, str(e)))
+        return partnerList, logLines, interfaceLines
+    bioMolecules = dict()
+    interfaces = dict()
+    for pdbChain in mol.calpha.keys():
+        logLines.append("Processing %s, chain %s.\n" % (pdb, pdbChain))
+        logLines.append("Found %d biomolecule(s).\n" % len(mol.biomol.keys()))
+        for biomolNumber in mol.biomol:
+            logLines.append("Processing biomolecule %d.\n" % biomolNumber)
+            if biomolNumber not in bioMolecules:
+                bioMolecules[biomolNumber] = mol.createUnit(biomolNumber)
+                interfaces[biomolNumber] = getInterfaces(bioMolecules[biomolNumber])
+            bioMolecule = bioMolecules[biomolNumber]
+            nChains = len(bioMolecule.calpha.keys())
+            if nChains > 1 and pdbChain in bioMolecule.calpha:
+                for bioChain in bioMolecule.calpha:
+                    if bioChain == pdbChain:
+                        continue
+                    if (pdbChain, bioChain) in interfaces[biomolNumber]:
+                        corePdbChain = "%s_%s" % (pdb.upper(), pdbChain[:1])
+                        partnerPdbChain = "%s_%s" % (pdb.upper(), bioChain[:1])
+                        partnerList.add("%s\t%s" % (corePdbChain, partnerPdbChain))
+                        if interfaceIndex:
+                            contacts, coreResidues, partnerResidues = getInterfaceRecord(bioMolecule, pdbChain, bioChain)
+                            record = [corePdbChain, partnerPdbChain, biomolNumber, pdbChain, bioChain, contacts, coreResidues, partnerResidues]
+                            interfaceLines.append("%s\n" % "\t".join(map(str, record)))
+                    else:
+                        logLines.append("Skipping: Chains have no interface [%s, %s].\n" % (pdbChain, bioChain))
+            else:
+                logLines.append("Skipping: Chain not found or single chain [%s].\n" % pdbChain)
+    return partnerList, logLines, interfaceLines
+
+
+def initWorker(indexFile, databaseFiles, zipped, interfaceIndex):
+    WORKER["pdbDatabase"] = DBKit(indexFile, databaseFiles, cacheSize=0)
+    WORKER["zipped"] = zipped
+    WORKER["interfaceIndex"] = interfaceIndex
+
+
+def processWorkerEntry(pdb):
+    return processEntry(pdb, WORKER["pdbDatabase"], WORKER["zipped"], interfaceIndex=WORKER["interfaceIndex"])
+
 
-def hasInterface(mol, chainA, chainB, distance=10.0, contacts=5):
-    count = 0
-    distance = distance ** 2
-    for residueA in mol.calpha[chainA]:
-        atomA = mol.calpha[chainA][residueA]
-        for residueB in mol.calpha[chainB]:
-            atomB = mol.calpha[chainB][residueB]
-            dist2 = ((atomA["x"] - atomB["x"]) ** 2 + (atomA["y"] - atomB["y"]) ** 2 + (atomA["z"] - atomB["z"]) ** 2)
-            if dist2 < distance:
-                count = count + 1
-                if count >= contacts:
-                    return True
-    return False
+def processEntries(args, entries):
+    workers = max(1, int(args.workers))
+    if workers == 1:
+        initWorker(args.index, args.database, args.zipped, bool(args.interfaces))
+        for pdb in entries:
+            yield pdb, processWorkerEntry(pdb)
+    else:
+        initArgs = (args.index, args.database, args.zipped, bool(args.interfaces))
+        with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=initArgs) as executor:
+            pending = deque()
+            entryIterator = iter(entries)
+            for pdb in entryIterator:
+                pending.append((pdb, executor.submit(processWorkerEntry, pdb)))
+                if len(pending) >= 4 * workers:
+                    break
+            while pending:
+                pdb, future = pending.popleft()
+                nextPdb = next(entryIterator, None)
+                if nextPdb is not None:
+                    pending.append((nextPdb, executor.submit(processWorkerEntry, nextPdb)))
+                yield pdb, future.result()
+
+
+def getSignature(pdbDatabase, pdb, zipped):
+    view = pdbDatabase.getView("pdb%s.ent" % pdb, zipped=zipped)
+    if view is None:
+        return None
+    return "%d\t%08x" % (len(view), zlib.crc32(view))
+
+
+def getSignatures(args, entries):
+    signatures = dict()
+    pdbDatabase = DBKit(args.index, args.database, cacheSize=0)
+    for pdb in entries:
+        signatures[pdb] = getSignature(pdbDatabase, pdb, args.zipped)
+    pdbDatabase.close()
+    return signatures
+
+
+def readManifest(fileName):
+    signatures = dict()
+    with open(fileName) as file:
+        for line in file:
+            cols = line.split()
+            if len(cols) != 3:
+                raise Exception("Invalid line in manifest [%s]." % line)
+            signatures[cols[0]] = "%s\t%s" % (cols[1], cols[2])
+    return signatures
+
+
+def readPrevious(fileName):
+    partners = dict()
+    with open(fileName) as file:
+        for line in file:
+            cols = line.split()
+            if len(cols) != 2:
+                raise Exception("Invalid line in crossreference [%s]." % line)
+            pdb = getName(cols[0])
+            if pdb not in partners:
+                partners[pdb] = set()
+            partners[pdb].add("%s\t%s" % (cols[0], cols[1]))
+    return partners
+
+
+def readPreviousInterfaces(fileName):
+    interfaces = dict()
+    with open(fileName) as file:
+        for line in file:
+            cols = line.split("\t")
+            if len(cols) != 8:
+                raise Exception("Invalid line in interface index [%s]." % line)
+            pdb = getName(cols[0])
+            if pdb not in interfaces:
+                interfaces[pdb] = list()
+            interfaces[pdb].append(line)
+    return interfaces
 
 
 def main(args):
     logFile = open(args.log, "w")
-    if not isdir("temp"):
-        mkdir("temp")
-    pdbCount = 0
     partnerList = set()
     entries = set()
     with open(args.index) as file:
         for line in file:
             entries.add(getName(line))
     logFile.write("Found %s template entries.\n" % len(entries))
-    pdbDatabase = DBKit(args.index, args.database)
-    for pdb in sorted(entries):
+    entries = sorted(entries)
+    interfaceLines = dict()
+    signatures = dict()
+    if args.manifest or args.previous_manifest:
+        signatures = getSignatures(args, entries)
+    if args.previous_manifest:
+        if not args.previous:
+            raise Exception("Previous cross reference required for incremental update.")
+        previousSignatures = readManifest(args.previous_manifest)
+        previousPartners = readPrevious(args.previous)
+        if args.interfaces:
+            if not args.previous_interfaces:
+                raise Exception("Previous interface index required for incremental update.")
+            previousInterfaces = readPreviousInterfaces(args.previous_interfaces)
+        unchanged = set([pdb for pdb in entries if signatures[pdb] is not None and previousSignatures.get(pdb) == signatures[pdb]])
+        for pdb in unchanged:
+            partnerList.update(previousPartners.get(pdb, set()))
+            if args.interfaces:
+                interfaceLines[pdb] = previousInterfaces.get(pdb, list())
+        entries = [pdb for pdb in entries if pdb not in unchanged]
+        logFile.write("Reusing %s unchanged entries, processing %s new or changed entries.\n" % (len(unchanged), len(entries)))
+    for pdb, (entryPartners, logLines, entryInterfaces) in processEntries(args, entries):
         print("Processing %s" % pdb)
-        pdbFile = "temp/temp.pdb"
-        pdbDatabaseId = "pdb%s.ent" % pdb
-        pdbDatabase.createFile(pdbDatabaseId, pdbFile, zipped=args.zipped)
-        try:
-            mol = Molecule(pdbFile)
-        except Exception as e:
-            logFile.write("Warning: Entry '%s' not found. %s.\n" % (pdbDatabaseId, str(e)))
-            continue
-        pdbCount = pdbCount + 1
-        for pdbChain in mol.calpha.keys():
-            logFile.write("Processing %s, chain %s.\n" % (pdb, pdbChain))
-            logFile.write("Found %d biomolecule(s).\n" % len(mol.biomol.keys()))
-            for biomolNumber in mol.biomol:
-                logFile.write("Processing biomolecule %d.\n" % biomolNumber)
-                bioMolecule = mol.createUnit(biomolNumber)
-                nChains = len(bioMolecule.calpha.keys())
-                if nChains > 1 and pdbChain in bioMolecule.calpha:
-                    for bioChain in bioMolecule.calpha:
-                        if bioChain == pdbChain:
-                            continue
-                        if hasInterface(bioMolecule, pdbChain, bioChain):
-                            corePdbChain = "%s_%s" % (pdb.upper(), pdbChain[:1])
-                            partnerPdbChain = "%s_%s" % (pdb.upper(), bioChain[:1])
-                            partnerList.add("%s\t%s" % (corePdbChain, partnerPdbChain))
-                        else:
-                            logFile.write("Skipping: Chains have no interface [%s, %s].\n" % (pdbChain, bioChain))
-                else:
-                    logFile.write("Skipping: Chain not found or single chain [%s].\n" % pdbChain)
-            logFile.flush()
+        partnerList.update(entryPartners)
+        interfaceLines[pdb] = entryInterfaces
+        logFile.writelines(logLines)
+        logFile.flush()
+    logFile.close()
     with open(args.output, 'w') as output_file:
         for entry in sorted(partnerList):
             output_file.write("%s\n" % entry)
+    if args.interfaces:
+        with open(args.interfaces, 'w') as interfaceFile:
+            for pdb in sorted(interfaceLines):
+                interfaceFile.writelines(interfaceLines[pdb])
+    if args.manifest:
+        with open(args.manifest, 'w') as manifestFile:
+            for pdb in sorted(signatures):
+                if signatures[pdb] is not None:
+                    manifestFile.write("%s\t%s\n" % (pdb, signatures[pdb]))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='List filtering.')
     parser.add_argument('-i', '--index', help='PDB Database Index file (ffindex)', required=True)
-    parser.add_argument('-d', '--database', help='PDB Database files (ffdata)', required=True)
+    parser.add_argument('-d', '--database', help='PDB Database files (ffdata), one per shard', nargs='+', required=True)
     parser.add_argument('-o', '--output', help='Output file', required=True)
     parser.add_argument('-g', '--log', help='Log File', required=True)
     parser.add_argument('-z', '--zipped', help="Zipped extension in PDB Database", required=False, default="")
+    parser.add_argument('-w', '--workers', help='Number of worker processes', type=int, default=1)
+    parser.add_argument('-m', '--manifest', help='Output manifest of processed entries', required=False)
+    parser.add_argument('-p', '--previous', help='Previous cross reference output', required=False)
+    parser.add_argument('-pm', '--previous_manifest', help='Manifest of the previous cross reference output', required=False)
+    parser.add_argument('-x', '--interfaces', help='Output interface index (core, partner, biomolecule, unit chains, contacts, residues)', required=False)
+    parser.add_argument('-px', '--previous_interfaces', help='Interface index of the previous cross reference output', required=False)
     args = parser.parse_args()
     main(args)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 import argparse
-from os import mkdir, system
+from os import mkdir, remove, system
 from os.path import isdir, isfile
 
 from spring_package.DBKit import DBKit
@@ -11,10 +11,13 @@ from spring_package.Utilities import getChain, getId, getName
 def getPDB(line, pdbDatabase, zipped):
     pdb = getName(line)
     pdbChain = getChain(line)
-    pdbFile = "temp/temp.pdb"
     pdbDatabaseId = "pdb%s.ent" % pdb
-    pdbDatabase.createFile(pdbDatabaseId, pdbFile, zipped=zipped)
-    return pdbFile, pdbChain
+    content = pdbDatabase.getBytes(pdbDatabaseId, zipped=zipped)
+    if content is None:
+        raise Exception("Entry not found [%s]." % pdbDatabaseId)
+    mol = Molecule()
+    mol.fromBytes(content, chains=[pdbChain], calphaOnly=True)
+    return mol, pdbChain
 
 
 def getSequences(fileName):
@@ -28,41 +31,124 @@ def getSequences(fileName):
     return sequences
 
 
-def findMatch(identifier, templates, databaseFile, pdbDatabase, evalue=0.0, zipped=None):
-    if identifier in templates:
-        return identifier
-    resultSub = identifier[:2]
-    fastaFile = "temp/%s/%s.fasta" % (resultSub, identifier)
-    resultFile = "%s.result" % fastaFile
-    if not isfile(resultFile):
-        resultDir = "temp/%s" % resultSub
-        if not isdir(resultDir):
-            mkdir(resultDir)
-        pdbFile, pdbChain = getPDB(identifier, pdbDatabase, zipped=zipped)
-        try:
-            mol = Molecule(pdbFile)
-            seq = mol.getSequence(pdbChain)
-            with open(fastaFile, "w") as fasta:
-                fasta.write(">%s\n" % identifier)
-                fasta.write("%s" % seq)
-            system("psiblast -query %s -db %s -out %s" % (fastaFile, databaseFile, resultFile))
-        except Exception:
-            return None
-    maxMatch = None
+def getCacheFile(identifier):
+    return "temp/%s/%s.tabular" % (identifier[:2], identifier)
+
+
+def getMatch(identifier, line, evalue, logFile):
+    if not line:
+        return None
     try:
-        with open(resultFile) as file:
-            for _i in range(38):
-                line = next(file)
-            columns = line.split()
-            maxMatch = getId(columns[0])
-            maxScore = float(columns[2])
-            if maxScore > evalue:
-                return None
+        columns = line.split()
+        maxMatch = getId(columns[1])
+        maxScore = float(columns[10])
     except Exception:
+        logFile.write("Warning: Invalid search result for %s [%s].\n" % (identifier, line.strip()))
+        return None
+    if maxScore > evalue:
         return None
     return maxMatch
 
 
+def readCache(identifier):
+    cacheFile = getCacheFile(identifier)
+    if not isfile(cacheFile):
+        return None
+    with open(cacheFile) as file:
+        return file.readline()
+
+
+def writeCache(identifier, line):
+    cacheDir = "temp/%s" % identifier[:2]
+    if not isdir(cacheDir):
+        mkdir(cacheDir)
+    with open(getCacheFile(identifier), "w") as file:
+        file.write(line)
+
+
+def searchSequences(queries, databaseFile, batchName):
+    fastaFile = "%s.fasta" % batchName
+    resultFile = "%s.tabular" % batchName
+    with open(fastaFile, "w") as fasta:
+        for identifier, seq in queries:
+            fasta.write(">%s\n" % identifier)
+            fasta.write("%s\n" % seq)
+    if isfile(resultFile):
+        remove(resultFile)
+    status = system("psiblast -query %s -db %s -outfmt 6 -out %s" % (fastaFile, databaseFile, resultFile))
+    if status != 0 or not isfile(resultFile):
+        return None
+    hits = dict()
+    with open(resultFile) as file:
+        for line in file:
+            queryId = line.split("\t", 1)[0]
+            if queryId not in hits:
+                hits[queryId] = line
+    return hits
+
+
+def getSequenceIndex(fileName):
+    sequenceIndex = dict()
+    for templateId, seq in getSequences(fileName).items():
+        seq = seq.strip()
+        if seq and seq not in sequenceIndex:
+            sequenceIndex[seq] = templateId
+    return sequenceIndex
+
+
+def findMatches(identifiers, templates, databaseFile, pdbDatabase, logFile, evalue=0.0, zipped=None, batchSize=1000, cache=False,
+                identity=False):
+    matches = dict()
+    sequenceIndex = getSequenceIndex(databaseFile) if identity else dict()
+    queries = dict()
+    identityCount = 0
+    for identifier in identifiers:
+        if identifier in templates:
+            matches[identifier] = identifier
+            continue
+        if cache:
+            line = readCache(identifier)
+            if line is not None:
+                matches[identifier] = getMatch(identifier, line, evalue, logFile)
+                continue
+        try:
+            mol, pdbChain = getPDB(identifier, pdbDatabase, zipped=zipped)
+            seq = mol.getSequence(pdbChain)
+        except Exception:
+            matches[identifier] = None
+            continue
+        if seq in sequenceIndex:
+            matches[identifier] = sequenceIndex[seq]
+            identityCount = identityCount + 1
+            continue
+        if seq not in queries:
+            queries[seq] = list()
+        queries[seq].append(identifier)
+    if identity:
+        logFile.write("Resolved %d identifiers by sequence identity.\n" % identityCount)
+    logFile.write("Searching %d unique sequences for %d identifiers.\n" % (len(queries), sum(map(len, queries.values()))))
+    queries = [(members[0], seq, members) for seq, members in queries.items()]
+    batchSize = max(1, batchSize)
+    for batchIndex, batchStart in enumerate(range(0, len(queries), batchSize)):
+        batch = queries[batchStart:batchStart + batchSize]
+        logFile.write("Searching batch %d with %d sequences.\n" % (batchIndex, len(batch)))
+        logFile.flush()
+        hits = searchSequences([(queryId, seq) for queryId, seq, _ in batch], databaseFile, "temp/batch_%d" % batchIndex)
+        if hits is None:
+            logFile.write("Warning: Failed psiblast search for batch %d.\n" % batchIndex)
+            for _, _, members in batch:
+                for identifier in members:
+                    matches[identifier] = None
+            continue
+        for queryId, _, members in batch:
+            line = hits.get(queryId, "")
+            for identifier in members:
+                if cache:
+                    writeCache(identifier, line)
+                matches[identifier] = getMatch(identifier, line, evalue, logFile)
+    return matches
+
+
 def main(args):
     if not isdir("temp"):
         mkdir("temp")
@@ -79,9 +165,8 @@ def main(args):
         with open(args.list) as file:
             for rawId in file:
                 templateId = getId(rawId)
-                pdbFile, pdbChain = getPDB(templateId, pdbDatabase, zipped=args.zipped)
                 try:
-                    templateMol = Molecule(pdbFile)
+                    templateMol, pdbChain = getPDB(templateId, pdbDatabase, zipped=args.zipped)
                     templateSeq = templateMol.getSequence(pdbChain)
                     templateSequences.write(">%s\n" % templateId)
                     templateSequences.write("%s\n" % templateSeq)
@@ -104,13 +189,21 @@ def main(args):
     logFile.write("Loaded crossreference with %d entries.\n" % len(crossReference))
     logFile.flush()
 
+    identifiers = list()
+    for refEntry in crossReference:
+        identifiers.append(refEntry["core"])
+        identifiers.append(refEntry["partner"])
+    matches = findMatches(list(dict.fromkeys(identifiers)), templates, templateSequenceFile, pdbDatabase, logFile, evalue=args.evalue,
+                          zipped=args.zipped, batchSize=args.batchsize, cache=args.cache == "true",
+                          identity=args.identity == "true")
+
     for refEntry in crossReference:
         coreId = refEntry["core"]
         logFile.write("Processing %s.\n" % coreId)
-        coreMatch = findMatch(coreId, templates, templateSequenceFile, pdbDatabase, evalue=args.evalue, zipped=args.zipped)
+        coreMatch = matches[coreId]
         partnerId = refEntry["partner"]
         logFile.write("Processing %s.\n" % partnerId)
-        partnerMatch = findMatch(partnerId, templates, templateSequenceFile, pdbDatabase, evalue=args.evalue, zipped=args.zipped)
+        partnerMatch = matches[partnerId]
         if partnerMatch is None or coreMatch is None:
             logFile.write("Warning: Failed alignment [%s, %s].\n" % (coreId, partnerId))
         else:
@@ -138,11 +231,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Maps binding partners to template library')
     parser.add_argument('-l', '--list', help='List of template entries `PDB_CHAIN`', required=True)
     parser.add_argument('-i', '--index', help='PDB Database Index file (ffindex)', required=True)
-    parser.add_argument('-d', '--database', help='PDB Database files (ffdata)', required=True)
+    parser.add_argument('-d', '--database', help='PDB Database files (ffdata), one per shard', nargs='+', required=True)
     parser.add_argument('-c', '--cross', help='Cross reference (unmapped)', required=True)
     parser.add_argument('-o', '--output', help='Cross reference', required=True)
     parser.add_argument('-g', '--log', help='Log File', required=True)
     parser.add_argument('-e', '--evalue', help='e-Value threshold', type=float, default=0.0)
     parser.add_argument('-z', '--zipped', help="Zipped extension in PDB Database", required=False, default="")
+    parser.add_argument('-bs', '--batchsize', help='Maximum number of sequences per psiblast run', type=int, default=1000)
+    parser.add_argument('-k', '--cache', help='Store and reuse per-identifier search results in temp/', required=False, default="false")
+    parser.add_argument('-s', '--identity', help='Map sequences identical to a template without search, ignoring the e-Value threshold',
+                        required=False, default="false")
     args = parser.parse_args()
     main(args)
@@ -9,7 +9,7 @@ if __name__ == "__main__":
     parser.add_argument('-a', '--a_hhr', help='First HHR target file result', required=True)
     parser.add_argument('-b', '--b_hhr', help='Second HHR target file result', required=True)
     parser.add_argument('-i', '--index', help='PDB Database Index file (ffindex)', required=True)
-    parser.add_argument('-d', '--database', help='PDB Database files (ffdata)', required=True)
+    parser.add_argument('-d', '--database', help='PDB Database files (ffdata), one per shard', nargs='+', required=True)
     parser.add_argument('-c', '--cross', help='PDB Cross Reference', required=True)
     parser.add_argument('-o', '--output', help='Output model file', required=True)
     parser.add_argument('-we', '--wenergy', help='Weight Energy term', type=float, default=-0.01, required=False)
@@ -17,6 +17,7 @@ if __name__ == "__main__":
     parser.add_argument('-mt', '--maxtries', help='Maximum number of templates', type=int, default=20, required=False)
     parser.add_argument('-mc', '--maxclashes', help='Maximum fraction of clashes', type=float, default=0.1, required=False)
     parser.add_argument('-sr', '--showtemplate', help='Add reference template to model structure', required=False, default="true")
+    parser.add_argument('-x', '--interfaces', help='Interface index from cross reference (optional)', required=False)
     parser.add_argument('-z', '--zipped', help="Zipped extension in PDB Database", required=False, default="")
     args = parser.parse_args()
     createModel(args)
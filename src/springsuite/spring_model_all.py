@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 import argparse
-from os import mkdir, remove
-from os.path import isdir, isfile
+from os import mkdir
+from os.path import isdir
 
 from spring_package.DBKit import DBKit
 from spring_package.Modeller import createModel
+from spring_package.Utilities import getInterfaceIndex
 
 
 class ModelArguments:
@@ -19,11 +20,14 @@ class ModelArguments:
         self.maxclashes = args.maxclashes
         self.showtemplate = args.showtemplate
         self.zipped = args.zipped
+        self.interfaces = args.interfaces
 
-    def set(self, a_hhr, b_hhr, output):
+    def set(self, a_hhr, b_hhr, output, a_content=None, b_content=None):
         self.a_hhr = a_hhr
         self.b_hhr = b_hhr
         self.output = output
+        self.a_content = a_content
+        self.b_content = b_content
 
 
 def main(args):
@@ -34,6 +38,8 @@ def main(args):
     if not isdir("temp"):
         mkdir("temp")
     dbkit = DBKit(args.hhr_index, args.hhr_database)
+    pdbDatabase = DBKit(args.index, args.database)
+    interfaceIndex = getInterfaceIndex(args.interfaces) if args.interfaces else None
     logFile = open(args.log, "w")
     logFile.write("#namea\t nameb\t springscore\t tmscore\t energy\t clashes\t zscore\t templatea\t templateb\n")
     with open(args.pairs, "r") as file:
@@ -41,17 +47,17 @@ def main(args):
             param = line.split()
             aIdentifier = param[0]
             bIdentifier = param[1]
-            aFile = "temp/%s" % aIdentifier
-            bFile = "temp/%s" % bIdentifier
-            if not dbkit.createFile(aIdentifier, aFile):
+            aContent = dbkit.getBytes(aIdentifier)
+            if aContent is None:
                 print("Failed to retrieve entry %s." % aIdentifier)
                 continue
-            if not dbkit.createFile(bIdentifier, bFile):
+            bContent = dbkit.getBytes(bIdentifier)
+            if bContent is None:
                 print("Failed to retrieve entry %s." % bIdentifier)
                 continue
             output = "%s/%s.%s.pdb" % (outPath, aIdentifier, bIdentifier)
-            modelArgs.set(a_hhr=aFile, b_hhr=bFile, output=output)
-            modelData = createModel(modelArgs)
+            modelArgs.set(a_hhr=aIdentifier, b_hhr=bIdentifier, output=output, a_content=aContent, b_content=bContent)
+            modelData = createModel(modelArgs, pdbDatabase=pdbDatabase, interfaceIndex=interfaceIndex)
             if modelData:
                 infoStr = "%s\t %s\t %5.2f\t %5.2f\t %5.2f\t %5.2f\t %5.2f\t %s\t %s\n"
                 infoStr = infoStr % (aIdentifier, bIdentifier,
@@ -64,20 +70,18 @@ def main(args):
                                      modelData["bTemplate"])
                 logFile.write(infoStr)
                 logFile.flush()
-            if isfile(aFile):
-                remove(aFile)
-            if isfile(bFile):
-                remove(bFile)
     logFile.close()
+    cacheInfo = pdbDatabase.getCacheInfo()
+    print("Template cache: %s hits, %s misses, %s entries." % (cacheInfo["hits"], cacheInfo["misses"], cacheInfo["entries"]))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create 3D models from HH-search results.')
     parser.add_argument('-p', '--pairs', help='Interaction table e.g. from min-Z evaluation (2-columns)', required=True)
     parser.add_argument('-ih', '--hhr_index', help='HHR Index database file (ffindex)', required=True)
-    parser.add_argument('-dh', '--hhr_database', help='HHR Database file (ffdata)', required=True)
+    parser.add_argument('-dh', '--hhr_database', help='HHR Database files (ffdata), one per shard', nargs='+', required=True)
     parser.add_argument('-i', '--index', help='PDB Database Index file (ffindex)', required=True)
-    parser.add_argument('-d', '--database', help='PDB Database file (ffdata)', required=True)
+    parser.add_argument('-d', '--database', help='PDB Database files (ffdata), one per shard', nargs='+', required=True)
     parser.add_argument('-c', '--cross', help='PDB Cross Reference', required=True)
     parser.add_argument('-g', '--log', help='Log file', required=True)
     parser.add_argument('-o', '--outputpath', help='Path to output directory', required=True)
@@ -86,6 +90,7 @@ if __name__ == "__main__":
     parser.add_argument('-mt', '--maxtries', help='Maximum number of templates', type=int, default=20, required=False)
     parser.add_argument('-mc', '--maxclashes', help='Maximum fraction of clashes', type=float, default=0.1, required=False)
     parser.add_argument('-sr', '--showtemplate', help='Add reference template to model structure', required=False, default="true")
+    parser.add_argument('-x', '--interfaces', help='Interface index from cross reference (optional)', required=False)
     parser.add_argument('-z', '--zipped', help="Zipped extension in PDB Database", required=False, default="")
     args = parser.parse_args()
     main(args)
@@ -2,33 +2,42 @@ from Bio import pairwise2
 
 
 class Alignment:
-    def __init__(self, fileName):
+    def __init__(self, fileName=None):
         self.queryName = None
         self.queryStart = list()
         self.queryAlignment = list()
         self.templateName = None
         self.templateStart = list()
         self.templateAlignment = list()
-        self.readFile(fileName)
+        if fileName is not None:
+            self.readFile(fileName)
 
     def readFile(self, fileName):
         with open(fileName) as file:
-            for line in file:
-                cols = line.split()
-                if len(cols) > 1 and cols[0] == "Query":
-                    self.queryName = cols[1].split()[0][0:14]
-                if len(cols) > 1 and cols[0].startswith(">"):
-                    self.templateName = cols[0][1:]
-                if self.queryName and self.templateName:
-                    if len(cols) > 2:
-                        if cols[0] == "Q" and cols[1] == self.queryName:
-                            self.queryStart.append(self.getStart(cols[2]))
-                            self.queryAlignment.append(cols[3])
-                        if cols[0] == "T" and cols[1] == self.templateName:
-                            self.templateStart.append(self.getStart(cols[2]))
-                            self.templateAlignment.append(cols[3])
-                if len(cols) > 1 and cols[0] == "No" and cols[1] == "2":
-                    break
+            self.readLines(file)
+
+    def fromText(self, text):
+        if isinstance(text, bytes):
+            text = text.decode()
+        self.readLines(text.splitlines())
+
+    def readLines(self, lines):
+        for line in lines:
+            cols = line.split()
+            if len(cols) > 1 and cols[0] == "Query":
+                self.queryName = cols[1].split()[0][0:14]
+            if len(cols) > 1 and cols[0].startswith(">"):
+                self.templateName = cols[0][1:]
+            if self.queryName and self.templateName:
+                if len(cols) > 2:
+                    if cols[0] == "Q" and cols[1] == self.queryName:
+                        self.queryStart.append(self.getStart(cols[2]))
+                        self.queryAlignment.append(cols[3])
+                    if cols[0] == "T" and cols[1] == self.templateName:
+                        self.templateStart.append(self.getStart(cols[2]))
+                        self.templateAlignment.append(cols[3])
+            if len(cols) > 1 and cols[0] == "No" and cols[1] == "2":
+                break
 
     def createModel(self, templateChain):
         hhrMapping = self.mapSequence(templateChain)
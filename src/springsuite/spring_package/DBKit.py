@@ -1,42 +1,288 @@
-from os.path import isfile
+from array import array
+from collections import OrderedDict
+from os import chmod, remove, replace, stat
+from os.path import abspath, basename, dirname, getsize, isfile
+from threading import Lock
 import gzip
+import mmap
+import struct
+import tempfile
 
-class DBKit:
-    def __init__(self, indexFile, databaseFile):
-        if not isfile(indexFile):
-            raise Exception("Index file not found: %s." % indexFile)    
-        if not isfile(databaseFile):
-            raise Exception("Database file not found: %s." % databaseFile)    
-        self.databaseFile = databaseFile
-        self.index = dict()
-        with open(indexFile) as file:
+INDEX_MAGIC = b"DBKI"
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct("=4sIQQq")
+CACHE_SIZE = 1 << 28
+
+
+class DBKitIndex:
+    def __init__(self, indexFile, cacheFile=None):
+        self.indexFile = indexFile
+        self.cacheFile = cacheFile if cacheFile is not None else "%s.bin" % indexFile
+        self.buffer = None
+        self.view = None
+        indexStat = stat(indexFile)
+        if not self.loadCache(indexStat):
+            content = self.createCache(indexStat)
+            self.view = memoryview(content)
+            try:
+                self.writeCache(content)
+            except OSError:
+                pass
+        self.setArrays()
+
+    def loadCache(self, indexStat):
+        if not isfile(self.cacheFile) or getsize(self.cacheFile) < INDEX_HEADER.size:
+            return False
+        try:
+            with open(self.cacheFile, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, version, count, size, mtime = INDEX_HEADER.unpack_from(buffer)
+        if (magic != INDEX_MAGIC or version != INDEX_VERSION
+           or size != indexStat.st_size or mtime != indexStat.st_mtime_ns
+           or len(buffer) != getCacheSize(buffer, count)):
+            buffer.close()
+            return False
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        return True
+
+    def createCache(self, indexStat):
+        entries = dict()
+        with open(self.indexFile) as file:
             for line in file:
                 cols = line.split()
                 try:
                     identifier = cols[0]
                     start = int(cols[1])
                     size = int(cols[2])
-                    self.index[identifier] = [start, size]
+                    shard = int(cols[3]) if len(cols) > 3 else 0
+                    entries[identifier.encode()] = (start, size, shard)
                 except Exception:
                     raise Exception("Invalid DBKit Index file format: %s." % line)
+        names = sorted(entries.keys())
+        starts = array("Q", [entries[name][0] for name in names])
+        sizes = array("Q", [entries[name][1] for name in names])
+        shards = array("I", [entries[name][2] for name in names])
+        nameOffsets = array("Q", [0])
+        for name in names:
+            nameOffsets.append(nameOffsets[-1] + len(name))
+        header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(names), indexStat.st_size, indexStat.st_mtime_ns)
+        return b"".join([header, starts.tobytes(), sizes.tobytes(), nameOffsets.tobytes(), shards.tobytes(), b"".join(names)])
 
-    def createFile(self, identifier, outputName, zipped=None):
+    def writeCache(self, content):
+        tempHandle, tempFile = tempfile.mkstemp(prefix="%s." % basename(self.cacheFile), suffix=".tmp",
+                                                dir=dirname(abspath(self.cacheFile)))
+        try:
+            with open(tempHandle, "wb") as file:
+                file.write(content)
+            chmod(tempFile, 0o644)
+            replace(tempFile, self.cacheFile)
+        except OSError:
+            if isfile(tempFile):
+                remove(tempFile)
+            raise
+
+    def setArrays(self):
+        self.count = INDEX_HEADER.unpack_from(self.view)[2]
+        offset = INDEX_HEADER.size
+        width = 8 * self.count
+        self.starts = self.view[offset:offset + width].cast("Q")
+        offset = offset + width
+        self.sizes = self.view[offset:offset + width].cast("Q")
+        offset = offset + width
+        self.nameOffsets = self.view[offset:offset + width + 8].cast("Q")
+        offset = offset + width + 8
+        self.shards = self.view[offset:offset + 4 * self.count].cast("I")
+        offset = offset + 4 * self.count
+        self.names = self.view[offset:]
+
+    def getName(self, position):
+        return bytes(self.names[self.nameOffsets[position]:self.nameOffsets[position + 1]])
+
+    def getPosition(self, identifier):
+        key = identifier.encode()
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.getName(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.getName(low) == key:
+            return low
+        return None
+
+    def get(self, identifier, default=None):
+        position = self.getPosition(identifier)
+        if position is None:
+            return default
+        self.checkShard(position)
+        return [self.starts[position], self.sizes[position]]
+
+    def checkShard(self, position):
+        if self.shards[position] != 0:
+            raise Exception("DBKit entry is located in shard %s, use getLocation: %s." % (self.shards[position], self.getName(position).decode()))
+
+    def getShardCount(self):
+        if self.count == 0:
+            return 0
+        return max(self.shards) + 1
+
+    def getLocation(self, identifier):
+        position = self.getPosition(identifier)
+        if position is None:
+            return None
+        return self.shards[position], self.starts[position], self.sizes[position]
+
+    def close(self):
+        for view in [self.starts, self.sizes, self.nameOffsets, self.shards, self.names, self.view]:
+            view.release()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, identifier):
+        entry = self.get(identifier)
+        if entry is None:
+            raise KeyError(identifier)
+        return entry
+
+    def __contains__(self, identifier):
+        return self.getPosition(identifier) is not None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self.getName(position).decode()
+
+    def items(self):
+        for position in range(self.count):
+            self.checkShard(position)
+            yield self.getName(position).decode(), [self.starts[position], self.sizes[position]]
+
+    def locations(self):
+        for position in range(self.count):
+            yield self.getName(position).decode(), (self.shards[position], self.starts[position], self.sizes[position])
+
+
+def getCacheSize(buffer, count):
+    offsetsEnd = INDEX_HEADER.size + 24 * count + 8
+    if len(buffer) < offsetsEnd:
+        return None
+    namesSize = struct.unpack_from("=Q", buffer, offsetsEnd - 8)[0]
+    return offsetsEnd + 4 * count + namesSize
+
+
+class DBKit:
+    def __init__(self, indexFile, databaseFile, cacheSize=CACHE_SIZE):
+        if not isfile(indexFile):
+            raise Exception("Index file not found: %s." % indexFile)
+        self.databaseFiles = getDatabaseFiles(databaseFile)
+        for fileName in self.databaseFiles:
+            if not isfile(fileName):
+                raise Exception("Database file not found: %s." % fileName)
+        self.databaseFile = self.databaseFiles[0]
+        self.databaseMaps = [None] * len(self.databaseFiles)
+        self.databaseViews = [None] * len(self.databaseFiles)
+        self.lock = Lock()
+        self.index = DBKitIndex(indexFile)
+        self.cache = OrderedDict()
+        self.cacheLock = Lock()
+        self.cacheSize = cacheSize
+        self.cacheUsed = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+
+    def getDatabaseView(self, shard=0):
+        if shard >= len(self.databaseFiles):
+            raise Exception("DBKit shard not found: %s." % shard)
+        if self.databaseViews[shard] is None:
+            with self.lock:
+                if self.databaseViews[shard] is None:
+                    databaseFile = self.databaseFiles[shard]
+                    if getsize(databaseFile) > 0:
+                        with open(databaseFile, "rb") as file:
+                            self.databaseMaps[shard] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                        self.databaseViews[shard] = memoryview(self.databaseMaps[shard])
+                    else:
+                        self.databaseViews[shard] = memoryview(b"")
+        return self.databaseViews[shard]
+
+    def getView(self, identifier, zipped=None):
         if zipped:
             identifier = "%s.%s" % (identifier, zipped)
-        if identifier in self.index:
-            entry = self.index[identifier]
-            start = entry[0]
-            size = entry[1]
-            with open(self.databaseFile, "rb") as file:
-                file.seek(start)
-                content = file.read(size)
-                with open(outputName, "wb") as outputFile:
-                    outputFile.write(content)
-            if zipped:
-                with gzip.open(outputName, "rb") as outputFile:
-                    content = outputFile.read()
-                with open(outputName, "wb") as outputFile:
-                    outputFile.write(content)
-            return True
-        else:
+        location = self.index.getLocation(identifier)
+        if location is None:
+            return None
+        shard, start, size = location
+        view = self.getDatabaseView(shard)
+        if start + size > len(view):
+            raise Exception("DBKit entry exceeds database size: %s." % identifier)
+        return view[start:start + size]
+
+    def getBytes(self, identifier, zipped=None):
+        if zipped:
+            return self.getDecompressed(identifier, zipped)
+        view = self.getView(identifier)
+        if view is None:
+            return None
+        return bytes(view)
+
+    def getDecompressed(self, identifier, zipped):
+        key = "%s.%s" % (identifier, zipped)
+        with self.cacheLock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.cacheHits = self.cacheHits + 1
+                return self.cache[key]
+            self.cacheMisses = self.cacheMisses + 1
+        view = self.getView(identifier, zipped=zipped)
+        if view is None:
+            return None
+        content = gzip.decompress(view)
+        if len(content) <= self.cacheSize:
+            with self.cacheLock:
+                if key not in self.cache:
+                    self.cache[key] = content
+                    self.cacheUsed = self.cacheUsed + len(content)
+                    while self.cacheUsed > self.cacheSize:
+                        oldKey, oldContent = self.cache.popitem(last=False)
+                        self.cacheUsed = self.cacheUsed - len(oldContent)
+        return content
+
+    def getCacheInfo(self):
+        with self.cacheLock:
+            return dict(hits=self.cacheHits, misses=self.cacheMisses, entries=len(self.cache), size=self.cacheUsed)
+
+    def createFile(self, identifier, outputName, zipped=None):
+        content = self.getBytes(identifier, zipped=zipped)
+        if content is None:
             return False
+        with open(outputName, "wb") as outputFile:
+            outputFile.write(content)
+        return True
+
+    def close(self):
+        with self.lock:
+            for shard in range(len(self.databaseFiles)):
+                if self.databaseViews[shard] is not None:
+                    self.databaseViews[shard].release()
+                    self.databaseViews[shard] = None
+                if self.databaseMaps[shard] is not None:
+                    try:
+                        self.databaseMaps[shard].close()
+                    except BufferError:
+                        pass
+                    self.databaseMaps[shard] = None
+            self.index.close()
+
+
+def getDatabaseFiles(databaseFile):
+    if isinstance(databaseFile, str):
+        return [databaseFile]
+    return list(databaseFile)
@@ -1,62 +1,130 @@
-import math
-from os.path import dirname, realpath
+import tempfile
+from os import chmod, remove, replace
+from os.path import basename, dirname, getmtime, isfile, realpath
+from threading import Lock
+
+import numpy as np
+
+from spring_package.Grid import Grid
 
 NTYPE = 21
 NDIST = 20
 NSCALE = 2.0
+POTENTIAL = dict()
+POTENTIAL_LOCK = Lock()
+RESIDUE_CODES = dict(A=0, C=1, D=2, E=3, F=4, G=5, H=6, I=7, K=8, L=9, M=10,
+                     N=11, P=12, Q=13, R=14, S=15, T=16, V=17, W=18, Y=19)
 
 
 class Energy:
     def __init__(self):
-        self.dfire = list()
-        dirPath = dirname(realpath(__file__))
-        with open("%s/Energy.data" % dirPath) as file:
-            for line in file:
-                self.dfire.append(float(line))
+        self.dfire = getPotential()
 
     def get(self, residuesA, residuesB):
-        result = 0
-        for atomA in residuesA:
-            indexA = self.toResCode(atomA["alignedResidue"])
-            for atomB in residuesB:
-                indexB = self.toResCode(atomB["alignedResidue"])
-                dist2 = ((atomA["x"] - atomB["x"]) ** 2 +
-                         (atomA["y"] - atomB["y"]) ** 2 +
-                         (atomA["z"] - atomB["z"]) ** 2)
-                dist = int((math.sqrt(dist2) * NSCALE))
-                if dist < NDIST:
-                    index = indexA * NTYPE * NDIST + indexB * NDIST + dist
-                    result = result + self.dfire[index]
-        return result
+        return float(self.getEnergies([(residuesA, residuesB)])[0])
+
+    def getScores(self, residuePairs, moleculePairs, minDist=5.0):
+        return self.getEnergies(residuePairs), self.getClashFractions(moleculePairs, minDist=minDist)
+
+    def getEnergies(self, residuePairs):
+        energies = np.zeros(len(residuePairs))
+        if len(residuePairs) == 0:
+            return energies
+        typesA, coordinatesA, labelsA = self.getStacked([residuesA for residuesA, _ in residuePairs], self.getResidues)
+        typesB, coordinatesB, labelsB = self.getStacked([residuesB for _, residuesB in residuePairs], self.getResidues)
+        grid = Grid(coordinatesB, NDIST / NSCALE, labels=labelsB)
+        contactsA, contactsB, dist2 = grid.getPairs(coordinatesA, NDIST / NSCALE, labels=labelsA)
+        dist = (np.sqrt(dist2) * NSCALE).astype(np.int64)
+        selected = dist < NDIST
+        contactsA = contactsA[selected]
+        contactsB = contactsB[selected]
+        values = self.dfire[typesA[contactsA], typesB[contactsB], dist[selected]]
+        labels = labelsA[contactsA]
+        boundaries = np.searchsorted(labels, np.arange(len(residuePairs) + 1))
+        for index in range(len(residuePairs)):
+            start, end = boundaries[index], boundaries[index + 1]
+            if end > start:
+                energies[index] = np.cumsum(values[start:end])[-1]
+        return energies
+
+    def getResidues(self, residues):
+        types = np.array([self.toResCode(atom["alignedResidue"]) for atom in residues], dtype=np.int64)
+        coordinates = np.array([(atom["x"], atom["y"], atom["z"]) for atom in residues], dtype=np.float64).reshape(-1, 3)
+        return types, coordinates
+
+    def getStacked(self, items, getArrays):
+        types = list()
+        coordinates = list()
+        labels = list()
+        for index, item in enumerate(items):
+            itemTypes, itemCoordinates = getArrays(item)
+            types.append(itemTypes)
+            coordinates.append(itemCoordinates)
+            labels.append(np.full(len(itemCoordinates), index, dtype=np.int64))
+        return np.concatenate(types), np.concatenate(coordinates), np.concatenate(labels)
 
     def getClashes(self, moleculeA, moleculeB, minDist=5.0):
-        minDist = minDist ** 2
-        clashes = 0
-        chainA = list(moleculeA.calpha.keys())[0]
-        chainB = list(moleculeB.calpha.keys())[0]
-        calphaA = moleculeA.calpha[chainA]
-        calphaB = moleculeB.calpha[chainB]
-        lenA = len(calphaA.keys())
-        lenB = len(calphaB.keys())
-        if lenA > lenB:
-            temp = calphaB
-            calphaB = calphaA
-            calphaA = temp
-            lenA = len(calphaA.keys())
-            lenB = len(calphaB.keys())
-        for i in calphaA:
-            atomA = calphaA[i]
-            for j in calphaB:
-                atomB = calphaB[j]
-                dist2 = ((atomA["x"] - atomB["x"]) ** 2 +
-                         (atomA["y"] - atomB["y"]) ** 2 +
-                         (atomA["z"] - atomB["z"]) ** 2)
-                if dist2 < minDist:
-                    clashes = clashes + 1
-                    break
-        return clashes / float(lenA)
+        return float(self.getClashFractions([(moleculeA, moleculeB)], minDist=minDist)[0])
+
+    def getClashFractions(self, moleculePairs, minDist=5.0):
+        if len(moleculePairs) == 0:
+            return np.zeros(0)
+        coordinatePairs = list()
+        for moleculeA, moleculeB in moleculePairs:
+            chainA = list(moleculeA.calpha.keys())[0]
+            chainB = list(moleculeB.calpha.keys())[0]
+            coordinatesA = moleculeA.getCoordinates(chainA)
+            coordinatesB = moleculeB.getCoordinates(chainB)
+            if len(coordinatesA) > len(coordinatesB):
+                coordinatesA, coordinatesB = coordinatesB, coordinatesA
+            coordinatePairs.append((coordinatesA, coordinatesB))
+        _, coordinatesA, labelsA = self.getStacked([pair[0] for pair in coordinatePairs], self.getPositions)
+        _, coordinatesB, labelsB = self.getStacked([pair[1] for pair in coordinatePairs], self.getPositions)
+        grid = Grid(coordinatesB, minDist, labels=labelsB)
+        neighbors = grid.hasNeighbors(coordinatesA, minDist, labels=labelsA)
+        clashes = np.bincount(labelsA[neighbors], minlength=len(moleculePairs))
+        sizes = np.bincount(labelsA, minlength=len(moleculePairs))
+        return clashes / sizes.astype(np.float64)
+
+    def getPositions(self, coordinates):
+        return np.zeros(len(coordinates), dtype=np.int64), coordinates
 
     def toResCode(self, seq):
-        code = dict(A=0, C=1, D=2, E=3, F=4, G=5, H=6, I=7, K=8, L=9, M=10,
-                    N=11, P=12, Q=13, R=14, S=15, T=16, V=17, W=18, Y=19)
-        return code[seq] if seq in code else 20
+        return RESIDUE_CODES[seq] if seq in RESIDUE_CODES else 20
+
+
+def getPotential(dataFile=None):
+    if dataFile is None:
+        dataFile = "%s/Energy.data" % dirname(realpath(__file__))
+    with POTENTIAL_LOCK:
+        if dataFile not in POTENTIAL:
+            POTENTIAL[dataFile] = loadPotential(dataFile)
+        return POTENTIAL[dataFile]
+
+
+def loadPotential(dataFile):
+    cacheFile = "%s.npy" % dataFile
+    if isfile(cacheFile) and getmtime(cacheFile) >= getmtime(dataFile):
+        try:
+            potential = np.load(cacheFile, mmap_mode="r")
+            if potential.shape == (NTYPE, NTYPE, NDIST) and potential.dtype == np.float64:
+                return potential
+        except (OSError, ValueError):
+            pass
+    dfire = list()
+    with open(dataFile) as file:
+        for line in file:
+            dfire.append(float(line))
+    potential = np.array(dfire).reshape(NTYPE, NTYPE, NDIST)
+    potential.setflags(write=False)
+    tempFile = None
+    try:
+        tempHandle, tempFile = tempfile.mkstemp(prefix="%s." % basename(cacheFile), suffix=".tmp", dir=dirname(cacheFile))
+        with open(tempHandle, "wb") as file:
+            np.save(file, potential)
+        chmod(tempFile, 0o644)
+        replace(tempFile, cacheFile)
+    except OSError:
+        if tempFile is not None and isfile(tempFile):
+            remove(tempFile)
+    return potential
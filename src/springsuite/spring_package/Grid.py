@@ -0,0 +1,93 @@
+import numpy as np
+
+GRID_SIZE = 1 << 16
+CELL_MARGIN = 1.0 + 1e-6
+
+
+class Grid:
+    def __init__(self, coordinates, cellSize, labels=None):
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        self.labels = self.getLabels(labels, len(self.coordinates))
+        self.cellSize = float(cellSize) * CELL_MARGIN
+        if len(self.coordinates) > 0:
+            self.origin = self.coordinates.min(axis=0)
+        else:
+            self.origin = np.zeros(3)
+        keys = self.getKeys(self.getCells(self.coordinates), self.labels)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def getCells(self, points):
+        return np.floor((points - self.origin) / self.cellSize).astype(np.int64)
+
+    def getLabels(self, labels, count):
+        if labels is None:
+            return np.zeros(count, dtype=np.int64)
+        return np.asarray(labels, dtype=np.int64)
+
+    def getKeys(self, cells, labels):
+        cells = cells % GRID_SIZE
+        labels = labels % (GRID_SIZE >> 1)
+        return ((labels * GRID_SIZE + cells[:, 0]) * GRID_SIZE + cells[:, 1]) * GRID_SIZE + cells[:, 2]
+
+    def getCandidates(self, points, distance, labels):
+        reach = max(1, int(np.ceil(distance / self.cellSize)))
+        cells = self.getCells(points)
+        pointIndices = list()
+        gridIndices = list()
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                for dz in range(-reach, reach + 1):
+                    keys = self.getKeys(cells + np.array([dx, dy, dz]), labels)
+                    starts = np.searchsorted(self.keys, keys, side="left")
+                    counts = np.searchsorted(self.keys, keys, side="right") - starts
+                    total = counts.sum()
+                    if total == 0:
+                        continue
+                    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+                    pointIndices.append(np.repeat(np.arange(len(points)), counts))
+                    gridIndices.append(self.order[np.arange(total) + offsets])
+        if not pointIndices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(pointIndices), np.concatenate(gridIndices)
+
+    def getPairs(self, points, distance, labels=None):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        labels = self.getLabels(labels, len(points))
+        pointIndices, gridIndices = self.getCandidates(points, distance, labels)
+        deltas = points[pointIndices] - self.coordinates[gridIndices]
+        dist2 = deltas[:, 0] ** 2 + deltas[:, 1] ** 2 + deltas[:, 2] ** 2
+        selected = (dist2 < distance ** 2) & (labels[pointIndices] == self.labels[gridIndices])
+        pointIndices = pointIndices[selected]
+        gridIndices = gridIndices[selected]
+        dist2 = dist2[selected]
+        order = np.lexsort((gridIndices, pointIndices))
+        return pointIndices[order], gridIndices[order], dist2[order]
+
+    def hasNeighbors(self, points, distance, labels=None):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        neighbors = np.zeros(len(points), dtype=bool)
+        pointIndices, _, _ = self.getPairs(points, distance, labels)
+        neighbors[pointIndices] = True
+        return neighbors
+
+    def countPairs(self, points, distance, labels=None):
+        pointIndices, _, _ = self.getPairs(points, distance, labels)
+        return len(pointIndices)
+
+
+def getContacts(coordinates, labels, distance):
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+    labels = np.asarray(labels, dtype=np.int64)
+    grid = Grid(coordinates, distance)
+    pointIndices, gridIndices, _ = grid.getPairs(coordinates, distance)
+    labelsA = labels[pointIndices]
+    labelsB = labels[gridIndices]
+    selected = labelsA != labelsB
+    if not selected.any():
+        return dict()
+    labelPairs, counts = np.unique(np.stack([labelsA[selected], labelsB[selected]], axis=1), axis=0, return_counts=True)
+    return {(labelA, labelB): count for (labelA, labelB), count in zip(labelPairs.tolist(), counts.tolist())}
@@ -6,27 +6,36 @@ from spring_package.Alignment import Alignment
 from spring_package.DBKit import DBKit
 from spring_package.Energy import Energy
 from spring_package.Molecule import Molecule
-from spring_package.Utilities import getChain, getCrossReference, getName, getTemplates
+from spring_package.Utilities import getChain, getCrossReference, getInterfaceIndex, getName, getTemplates
 
 
-def createPDB(identifier, pdbDatabase, outputName, zipped=None):
+def getPDB(identifier, pdbDatabase, zipped=None, chains=None, calphaOnly=False):
     pdb = getName(identifier)
     pdbDatabaseId = "pdb%s.ent" % pdb
-    return pdbDatabase.createFile(pdbDatabaseId, outputName, zipped=zipped)
+    content = pdbDatabase.getBytes(pdbDatabaseId, zipped=zipped)
+    if content is None:
+        return None
+    molecule = Molecule()
+    molecule.fromBytes(content, chains=chains, calphaOnly=calphaOnly)
+    return molecule
 
 
-def createMonomer(resultFile, identifier, pdbDatabase, outputName, zipped=None):
+def createMonomer(resultFile, identifier, pdbDatabase, outputName, zipped=None, content=None):
     print("Building model with: %s." % identifier)
-    if not createPDB(identifier, pdbDatabase, outputName, zipped=zipped):
+    pdbChain = getChain(identifier)
+    template = getPDB(identifier, pdbDatabase, zipped=zipped, chains=[pdbChain], calphaOnly=True)
+    if template is None:
         print("Template not found in database [%s]" % identifier)
         return False
-    template = Molecule(outputName)
-    pdbChain = getChain(identifier)
     if pdbChain not in template.calpha:
         print("Chain not found in template [%s]" % pdbChain)
         return False
     chain = template.calpha[pdbChain]
-    alignment = Alignment(resultFile)
+    alignment = Alignment()
+    if content is not None:
+        alignment.fromText(content)
+    else:
+        alignment.readFile(resultFile)
     alignment.createModel(chain)
     template.saveChain(pdbChain, outputName)
     try:
@@ -64,8 +73,7 @@ def TMalign(fileA, fileB, tmName="temp/tmalign"):
         except Exception:
             raise Exception("TMalign::Failed to retrieve TMscore.")
     molecule = Molecule(fileA)
-    for atom in molecule.atoms:
-        molecule.applyMatrix(atom, rotmat)
+    molecule.transform(rotmat)
     return tmscore, molecule
 
 
@@ -116,43 +124,64 @@ def getFrameworks(aTemplates, bTemplates, crossReference, minScore, maxTries):
         yield templateHit["templatePair"], templateHit["score"]
 
 
-def createModel(args):
+def getInterfaceResidues(interfaces, biomolNumber, coreChain, partnerChain):
+    if interfaces is None:
+        return None
+    for interface in interfaces:
+        if interface["biomol"] == biomolNumber and interface["coreChain"] == coreChain and interface["partnerChain"] == partnerChain:
+            return interface["coreResidues"], interface["partnerResidues"]
+    return None
+
+
+def createModel(args, pdbDatabase=None, interfaceIndex=None):
     print("SPRING - Complex Model Creation")
     aName = basename(args.a_hhr)
     bName = basename(args.b_hhr)
     print("Sequence A: %s" % aName)
     print("Sequence B: %s" % bName)
-    aTop, aTemplates = getTemplates(args.a_hhr)
-    bTop, bTemplates = getTemplates(args.b_hhr)
+    aContent = getattr(args, "a_content", None)
+    bContent = getattr(args, "b_content", None)
+    aTop, aTemplates = getTemplates(args.a_hhr, content=aContent)
+    bTop, bTemplates = getTemplates(args.b_hhr, content=bContent)
     if not isdir("temp"):
         mkdir("temp")
     outputName = args.output
-    pdbDatabase = DBKit(args.index, args.database)
+    if pdbDatabase is None:
+        pdbDatabase = DBKit(args.index, args.database)
     crossReference = getCrossReference(args.cross)
+    if interfaceIndex is None and getattr(args, "interfaces", None):
+        interfaceIndex = getInterfaceIndex(args.interfaces)
     interfaceEnergy = Energy()
-    if not createMonomer(args.a_hhr, aTop, pdbDatabase, "temp/monomerA.pdb", zipped=args.zipped):
+    if not createMonomer(args.a_hhr, aTop, pdbDatabase, "temp/monomerA.pdb", zipped=args.zipped, content=aContent):
         print("Warning: Failed to determine monomer model for %s." % args.a_hhr)
         return False
-    if not createMonomer(args.b_hhr, bTop, pdbDatabase, "temp/monomerB.pdb", zipped=args.zipped):
+    if not createMonomer(args.b_hhr, bTop, pdbDatabase, "temp/monomerB.pdb", zipped=args.zipped, content=bContent):
         print("Warning: Failed to determine monomer model for %s." % args.b_hhr)
         return False
-    maxScore = -9999
-    maxInfo = None
     minScore = float(args.minscore)
     maxTries = int(args.maxtries)
+    candidates = list()
     for [aTemplate, bTemplate], zscore in getFrameworks(aTemplates, bTemplates, crossReference, minScore=minScore, maxTries=maxTries):
         print("Evaluating Complex Template: %s." % aTemplate)
-        templateFile = "temp/template.pdb"
-        createPDB(aTemplate, pdbDatabase, templateFile, zipped=args.zipped)
-        templateMolecule = Molecule(templateFile)
+        interfaces = None
+        if interfaceIndex is not None:
+            interfaces = interfaceIndex.get((aTemplate, bTemplate))
+            if interfaces is None:
+                print("Interface not found in index [%s, %s]" % (aTemplate, bTemplate))
+                continue
+        templateMolecule = getPDB(aTemplate, pdbDatabase, zipped=args.zipped, calphaOnly=args.showtemplate != "true")
+        if templateMolecule is None:
+            print("Template not found in database [%s]" % aTemplate)
+            continue
         aTemplateChain = getChain(aTemplate)
         bTemplateChain = getChain(bTemplate)
         if aTemplateChain == bTemplateChain:
             bTemplateChain = "%s_0" % bTemplateChain
         print("Evaluating chain %s and %s..." % (aTemplate, bTemplate))
-        biomolFound = False
         for biomolNumber in templateMolecule.biomol:
-            bioMolecule = templateMolecule.createUnit(biomolNumber)
+            if interfaces is not None and biomolNumber not in [interface["biomol"] for interface in interfaces]:
+                continue
+            bioMolecule = templateMolecule.createUnit(biomolNumber, chains=[aTemplateChain, bTemplateChain])
             if (len(bioMolecule.calpha.keys()) > 1
                and aTemplateChain in bioMolecule.calpha
                and bTemplateChain in bioMolecule.calpha):
@@ -168,25 +197,41 @@ def createModel(args):
                     print("Warning: Failed TMalign [%s]." % bTemplateChain)
                     print(str(e))
                     continue
-                biomolFound = True
-                print("  zscore:\t%5.2f" % zscore)
-                tmscore = min(coreScore, partnerScore)
-                print("  tmscore:\t%5.2f" % tmscore)
-                energy = -interfaceEnergy.get(coreAligned, partnerAligned)
-                print("  energy:\t%5.2f" % energy)
-                clashes = interfaceEnergy.getClashes(coreMolecule, partnerMolecule)
-                print("  clashes:\t%5.2f" % clashes)
-                springscore = tmscore + energy * args.wenergy
-                print("  springscore:\t%5.2f" % springscore)
-                if springscore > maxScore and clashes < args.maxclashes:
-                    maxScore = springscore
-                    maxInfo = dict(aTemplate=aTemplate, bTemplate=bTemplate, springscore=springscore, tmscore=tmscore, energy=energy, clashes=clashes, zscore=zscore)
-                    coreMolecule.save(outputName, chainName="0")
-                    partnerMolecule.save(outputName, chainName="1", append=True)
-                    if args.showtemplate == "true":
-                        bioMolecule.save(outputName, append=True)
-            if biomolFound:
+                interfaceResidues = getInterfaceResidues(interfaces, biomolNumber, aTemplateChain, bTemplateChain)
+                if interfaceResidues is not None:
+                    coreResidues, partnerResidues = interfaceResidues
+                    coreAligned = [residue for residue in coreAligned if residue["residueNumber"] in coreResidues]
+                    partnerAligned = [residue for residue in partnerAligned if residue["residueNumber"] in partnerResidues]
+                candidates.append(dict(aTemplate=aTemplate, bTemplate=bTemplate, zscore=zscore, tmscore=min(coreScore, partnerScore),
+                                       coreAligned=coreAligned, partnerAligned=partnerAligned, coreMolecule=coreMolecule,
+                                       partnerMolecule=partnerMolecule, templateMolecule=templateMolecule, biomolNumber=biomolNumber))
                 break
+    energies, clashFractions = interfaceEnergy.getScores([(c["coreAligned"], c["partnerAligned"]) for c in candidates],
+                                                         [(c["coreMolecule"], c["partnerMolecule"]) for c in candidates])
+    maxScore = -9999
+    maxInfo = None
+    maxCandidate = None
+    for candidate, energy, clashes in zip(candidates, energies.tolist(), clashFractions.tolist()):
+        print("Scoring %s and %s, biomolecule %i..." % (candidate["aTemplate"], candidate["bTemplate"], candidate["biomolNumber"]))
+        zscore = candidate["zscore"]
+        print("  zscore:\t%5.2f" % zscore)
+        tmscore = candidate["tmscore"]
+        print("  tmscore:\t%5.2f" % tmscore)
+        energy = -energy if energy else 0.0
+        print("  energy:\t%5.2f" % energy)
+        print("  clashes:\t%5.2f" % clashes)
+        springscore = tmscore + energy * args.wenergy
+        print("  springscore:\t%5.2f" % springscore)
+        if springscore > maxScore and clashes < args.maxclashes:
+            maxScore = springscore
+            maxInfo = dict(aTemplate=candidate["aTemplate"], bTemplate=candidate["bTemplate"], springscore=springscore, tmscore=tmscore,
+                           energy=energy, clashes=clashes, zscore=zscore)
+            maxCandidate = candidate
+    if maxCandidate is not None:
+        maxCandidate["coreMolecule"].save(outputName, chainName="0")
+        maxCandidate["partnerMolecule"].save(outputName, chainName="1", append=True)
+        if args.showtemplate == "true":
+            maxCandidate["templateMolecule"].createUnit(maxCandidate["biomolNumber"]).save(outputName, append=True)
     if maxInfo is not None:
         print("Final Model:")
         for key in maxInfo:
@@ -1,83 +1,349 @@
+import struct
+
+import numpy as np
+
+BINARY_MAGIC = b"SPRB"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("=4sIIII")
+BINARY_CHAIN = struct.Struct("=4sQQ")
+BINARY_OPERATOR = struct.Struct("=II12d")
+BINARY_COLUMNS = [("coordinates", np.float64, 3), ("occupancies", np.float64, 1), ("temperatures", np.float64, 1),
+                  ("atomNumbers", np.int64, 1), ("residueNumbers", np.int64, 1), ("atomNames", "S4", 1),
+                  ("residues", "S3", 1), ("chainNames", "S4", 1)]
+COORDINATES = dict(x=0, y=1, z=2)
+COLUMNS = dict(atomNumber="atomNumbers", atomName="atomNames", residue="residues", residueNumber="residueNumbers",
+               chainName="chainNames", occupancy="occupancies", temperature="temperatures")
+
+
+class Atom:
+    __slots__ = ["molecule", "index"]
+
+    def __init__(self, molecule, index):
+        self.molecule = molecule
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.molecule.getValue(self.index, key)
+
+    def __setitem__(self, key, value):
+        self.molecule.setValue(self.index, key, value)
+
+    def __contains__(self, key):
+        return key in COORDINATES or key in COLUMNS or self.index in self.molecule.attributes.get(key, ())
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        keys = list(COORDINATES) + list(COLUMNS)
+        return keys + [key for key in self.molecule.attributes if self.index in self.molecule.attributes[key]]
+
+    def copy(self):
+        return {key: self[key] for key in self.keys()}
+
+
+class Atoms:
+    def __init__(self, molecule):
+        self.molecule = molecule
+
+    def __len__(self):
+        return len(self.molecule.coordinates)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index = index + len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return Atom(self.molecule, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Atom(self.molecule, index)
+
+
+class Chain:
+    def __init__(self, molecule, residueNumbers, indices):
+        self.molecule = molecule
+        self.residueNumbers = np.asarray(residueNumbers, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.lookup = None
+
+    def getLookup(self):
+        if self.lookup is None:
+            self.lookup = dict(zip(self.residueNumbers.tolist(), self.indices.tolist()))
+        return self.lookup
+
+    def getCoordinates(self):
+        return self.molecule.coordinates[self.indices]
+
+    def __getitem__(self, residueNumber):
+        return Atom(self.molecule, self.getLookup()[residueNumber])
+
+    def __contains__(self, residueNumber):
+        return residueNumber in self.getLookup()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        return iter(self.residueNumbers.tolist())
+
+    def keys(self):
+        return self.residueNumbers.tolist()
+
+    def values(self):
+        return [Atom(self.molecule, index) for index in self.indices.tolist()]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+
 class Molecule:
     def __init__(self, fileName=None):
         self.calpha = dict()
         self.biomol = dict()
-        self.atoms = list()
+        self.attributes = dict()
+        self.records = list()
+        self.chainRanges = dict()
+        self.compiled = False
+        self.atoms = Atoms(self)
+        self.setAtoms()
         if fileName is not None:
             self.fromFile(fileName)
 
+    def setAtoms(self, coordinates=None, atomNumbers=None, atomNames=None, residues=None, residueNumbers=None,
+                 chainNames=None, occupancies=None, temperatures=None):
+        self.coordinates = np.zeros((0, 3)) if coordinates is None else np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        self.atomNumbers = self.getColumn(atomNumbers, np.int64)
+        self.atomNames = self.getColumn(atomNames, str)
+        self.residues = self.getColumn(residues, str)
+        self.residueNumbers = self.getColumn(residueNumbers, np.int64)
+        self.chainNames = self.getColumn(chainNames, str)
+        self.occupancies = self.getColumn(occupancies, np.float64)
+        self.temperatures = self.getColumn(temperatures, np.float64)
+
+    def getColumn(self, values, dtype):
+        if values is None:
+            return np.zeros(len(self.coordinates), dtype=dtype)
+        return np.asarray(values, dtype=dtype)
+
     def fromFile(self, fileName):
-        biomolNumber = 0
-        biomolChains = list()
+        with open(fileName, "rb") as file:
+            self.fromBytes(file.read())
+
+    def fromBytes(self, content, chains=None, calphaOnly=False):
+        self.readHeader(content)
+        self.readAtoms(chains=chains, calphaOnly=calphaOnly)
+
+    def readHeader(self, content):
         self.biomol[0] = None
-        with open(fileName) as file:
+        if content[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+            self.fromBinary(content)
+            return
+        lines = content.splitlines()
+        self.records = [line for line in lines if line[0:6].strip() == b"ATOM"]
+        self.chainRanges = dict()
+        previousChain = None
+        for index, line in enumerate(self.records):
+            chainName = line[21:22]
+            if chainName != previousChain:
+                chainName = chainName.decode()
+                if chainName not in self.chainRanges:
+                    self.chainRanges[chainName] = list()
+                self.chainRanges[chainName].append([index, index + 1])
+                previousChain = line[21:22]
+            else:
+                self.chainRanges[chainName.decode()][-1][1] = index + 1
+        if b"REMARK 350 BIOMOLECULE:" in content:
+            file = iter(lines)
             for line in file:
-                key = line[0:6].strip()
-                if key == "ATOM":
-                    atom = line[12:16]
-                    atomNumber = line[6:11]
-                    chainName = line[21:22]
-                    if chainName not in self.calpha:
-                        self.calpha[chainName] = dict()
-                    x = self.toFloat(line[30:38])
-                    y = self.toFloat(line[38:46])
-                    z = self.toFloat(line[46:54])
-                    occupancy = self.toFloat(line[54:60], optional=True)
-                    temperature = self.toFloat(line[54:60], optional=True)
-                    residue = line[17:20]
-                    residueNumber = self.toInt(line[22:26])
-                    atomNumber = self.toInt(line[6:11])
-                    atomName = line[12:16]
-                    atomDict = dict(x=x, y=y, z=z,
-                                    residue=residue,
-                                    occupancy=occupancy,
-                                    temperature=temperature,
-                                    atomNumber=atomNumber,
-                                    atomName=atomName,
-                                    residueNumber=residueNumber,
-                                    chainName=chainName)
-                    if atom.strip() == "CA":
-                        self.calpha[chainName][residueNumber] = atomDict
-                    self.atoms.append(atomDict)
-                biokey = "REMARK 350 BIOMOLECULE:"
-                if line[0:len(biokey)] == biokey:
-                    biomolNumber = self.toInt(line[len(biokey):])
-                    if biomolNumber == 0:
-                        raise Exception("Invalid biomolecule identifier [0].")
-                    biokey = "REMARK 350 APPLY THE FOLLOWING TO CHAINS:"
-                    nextLine = next(file)
-                    while nextLine[:len(biokey)] != biokey:
-                        nextLine = next(file)
-                    biomolChains = nextLine[len(biokey):].split(",")
-                    biomolChains = list(map(lambda x: x.strip(), biomolChains))
-                    biokey = "REMARK 350                    AND CHAINS:"
-                    nextLine = next(file)
-                    while nextLine[:len(biokey)] == biokey:
-                        moreChains = nextLine[len(biokey):].split(",")
-                        moreChains = list(map(lambda x: x.strip(), moreChains))
-                        biomolChains = biomolChains + moreChains
-                        nextLine = next(file)
-                    biokey = "REMARK 350   BIOMT"
-                    if nextLine[:len(biokey)] == biokey:
-                        biomolMatId1, biomolMat1 = self.getFloats(nextLine)
-                        nextLine = next(file)
-                        biomolMatId2, biomolMat2 = self.getFloats(nextLine)
-                        nextLine = next(file)
-                        biomolMatId3, biomolMat3 = self.getFloats(nextLine)
-                        if biomolMatId1 != biomolMatId2 or biomolMatId1 != biomolMatId3:
-                            raise Exception("Invalid rotation matrix format [%s]." % biomolMatId1)
-                        matrix = [biomolMat1, biomolMat2, biomolMat3]
-                        biomolChains = [c for c in biomolChains if c]
-                        if biomolNumber not in self.biomol:
-                            self.biomol[biomolNumber] = list()
-                        self.biomol[biomolNumber].append(dict(chains=biomolChains, matrix=matrix))
-        removeChains = []
-        for chainName in self.calpha:
-            if len(self.calpha[chainName]) == 0:
-                removeChains.append(chainName)
-        for chainName in removeChains:
-            del self.calpha[chainName]
-        if not self.calpha:
+                if line.startswith(b"REMARK 350 BIOMOLECULE:"):
+                    self.readBiomolecule(line.decode(), map(bytes.decode, file))
+
+    def getChainNames(self):
+        return list(self.chainRanges.keys())
+
+    def hasMultipleChains(self):
+        if len(self.chainRanges) > 1:
+            return True
+        for biomolNumber in self.biomol:
+            if biomolNumber > 0 and sum([len(matrixDict["chains"]) for matrixDict in self.biomol[biomolNumber]]) > 1:
+                return True
+        return False
+
+    def readAtoms(self, chains=None, calphaOnly=False):
+        if self.compiled:
+            if chains is not None:
+                self.calpha = {chainName: self.calpha[chainName] for chainName in self.calpha if chainName in chains}
+            return
+        if chains is None:
+            chainOrder = self.getChainNames()
+            atomLines = self.records
+        else:
+            chainOrder = [chainName for chainName in self.chainRanges if chainName in chains]
+            ranges = sorted([r for chainName in chainOrder for r in self.chainRanges[chainName]])
+            atomLines = [line for start, end in ranges for line in self.records[start:end]]
+        if calphaOnly:
+            atomLines = [line for line in atomLines if line[12:16].strip() == b"CA"]
+        records = np.array(atomLines, dtype="S60")
+        columns = records.view(np.uint8).reshape(len(atomLines), 60)
+        occupancies = self.toArray(self.getField(columns, 54, 60), np.float64, optional=True)
+        self.setAtoms(np.stack([self.toArray(self.getField(columns, 30, 38), np.float64),
+                                self.toArray(self.getField(columns, 38, 46), np.float64),
+                                self.toArray(self.getField(columns, 46, 54), np.float64)], axis=1),
+                      self.toArray(self.getField(columns, 6, 11), np.int64),
+                      self.getField(columns, 12, 16).astype("U4"),
+                      self.getField(columns, 17, 20).astype("U3"),
+                      self.toArray(self.getField(columns, 22, 26), np.int64),
+                      self.getField(columns, 21, 22).astype("U1"),
+                      occupancies, occupancies)
+        self.calpha = dict()
+        self.setCalpha(chainOrder, required=chains is None)
+
+    def fromBinary(self, content):
+        magic, version, atomCount, chainCount, operatorCount = BINARY_HEADER.unpack_from(content)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise Exception("Invalid binary molecule format [%s]." % version)
+        offset = BINARY_HEADER.size
+        columns = dict()
+        for columnName, dtype, width in BINARY_COLUMNS:
+            column = np.frombuffer(content, dtype=dtype, count=atomCount * width, offset=offset)
+            offset = offset + column.nbytes
+            columns[columnName] = column.astype("U%d" % column.dtype.itemsize) if column.dtype.kind == "S" else column.copy()
+        self.setAtoms(**columns)
+        self.compiled = True
+        self.records = list()
+        self.chainRanges = dict()
+        self.calpha = dict()
+        for i in range(chainCount):
+            chainName, start, count = BINARY_CHAIN.unpack_from(content, offset)
+            offset = offset + BINARY_CHAIN.size
+            chainName = chainName.rstrip(b"\0").decode()
+            indices = np.arange(start, start + count)
+            self.chainRanges[chainName] = [[start, start + count]]
+            self.calpha[chainName] = Chain(self, self.residueNumbers[indices], indices)
+        for i in range(operatorCount):
+            operator = BINARY_OPERATOR.unpack_from(content, offset)
+            offset = offset + BINARY_OPERATOR.size
+            biomolNumber, chainsLength = operator[:2]
+            biomolChains = [c for c in bytes(content[offset:offset + chainsLength]).decode().split(",") if c]
+            offset = offset + chainsLength
+            matrix = [list(operator[2:6]), list(operator[6:10]), list(operator[10:14])]
+            if biomolNumber not in self.biomol:
+                self.biomol[biomolNumber] = list()
+            self.biomol[biomolNumber].append(dict(chains=biomolChains, matrix=matrix))
+
+    def toBinary(self):
+        chainNames = list(self.calpha.keys())
+        indices = [self.calpha[chainName].indices for chainName in chainNames]
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        operators = [(biomolNumber, matrixDict) for biomolNumber in self.biomol if biomolNumber > 0
+                     for matrixDict in self.biomol[biomolNumber]]
+        content = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(indices), len(chainNames), len(operators))]
+        for columnName, dtype, width in BINARY_COLUMNS:
+            column = getattr(self, columnName)[indices]
+            if column.dtype.kind == "U":
+                column = np.char.encode(column)
+            content.append(column.astype(dtype).tobytes())
+        start = 0
+        for chainName in chainNames:
+            count = len(self.calpha[chainName])
+            content.append(BINARY_CHAIN.pack(chainName.encode(), start, count))
+            start = start + count
+        for biomolNumber, matrixDict in operators:
+            matrix = matrixDict["matrix"]
+            if len(matrix) != 3 or min(map(len, matrix)) < 4:
+                raise Exception("Invalid rotation matrix format [%s]." % biomolNumber)
+            biomolChains = ",".join(matrixDict["chains"]).encode()
+            content.append(BINARY_OPERATOR.pack(biomolNumber, len(biomolChains), *[value for row in matrix for value in row[:4]]))
+            content.append(biomolChains)
+        return b"".join(content)
+
+    def getField(self, columns, start, end):
+        return np.ascontiguousarray(columns[:, start:end]).view("S%d" % (end - start)).ravel()
+
+    def toArray(self, field, dtype, optional=False):
+        try:
+            return field.astype(dtype)
+        except ValueError:
+            if dtype is np.int64:
+                return np.array([self.toInt(x.decode()) for x in field], dtype=dtype)
+            return np.array([self.toFloat(x.decode(), optional=optional) for x in field], dtype=dtype)
+
+    def fromLines(self, lines):
+        self.biomol[0] = None
+        coordinates = list()
+        atomNumbers = list()
+        atomNames = list()
+        residues = list()
+        residueNumbers = list()
+        chainNames = list()
+        occupancies = list()
+        file = iter(lines)
+        for line in file:
+            key = line[0:6].strip()
+            if key == "ATOM":
+                x = self.toFloat(line[30:38])
+                y = self.toFloat(line[38:46])
+                z = self.toFloat(line[46:54])
+                occupancy = self.toFloat(line[54:60], optional=True)
+                coordinates.append((x, y, z))
+                residueNumbers.append(self.toInt(line[22:26]))
+                atomNumbers.append(self.toInt(line[6:11]))
+                atomNames.append(line[12:16])
+                residues.append(line[17:20])
+                chainNames.append(line[21:22])
+                occupancies.append(occupancy)
+            if line.startswith("REMARK 350 BIOMOLECULE:"):
+                self.readBiomolecule(line, file)
+        self.setAtoms(coordinates, atomNumbers, atomNames, residues, residueNumbers, chainNames, occupancies, occupancies)
+        self.setCalpha()
+
+    def readBiomolecule(self, line, file):
+        biokey = "REMARK 350 BIOMOLECULE:"
+        biomolNumber = self.toInt(line[len(biokey):])
+        if biomolNumber == 0:
+            raise Exception("Invalid biomolecule identifier [0].")
+        biokey = "REMARK 350 APPLY THE FOLLOWING TO CHAINS:"
+        nextLine = next(file)
+        while nextLine[:len(biokey)] != biokey:
+            nextLine = next(file)
+        biomolChains = nextLine[len(biokey):].split(",")
+        biomolChains = list(map(lambda x: x.strip(), biomolChains))
+        biokey = "REMARK 350                    AND CHAINS:"
+        nextLine = next(file)
+        while nextLine[:len(biokey)] == biokey:
+            moreChains = nextLine[len(biokey):].split(",")
+            moreChains = list(map(lambda x: x.strip(), moreChains))
+            biomolChains = biomolChains + moreChains
+            nextLine = next(file)
+        biokey = "REMARK 350   BIOMT"
+        if nextLine[:len(biokey)] == biokey:
+            biomolMatId1, biomolMat1 = self.getFloats(nextLine)
+            nextLine = next(file)
+            biomolMatId2, biomolMat2 = self.getFloats(nextLine)
+            nextLine = next(file)
+            biomolMatId3, biomolMat3 = self.getFloats(nextLine)
+            if biomolMatId1 != biomolMatId2 or biomolMatId1 != biomolMatId3:
+                raise Exception("Invalid rotation matrix format [%s]." % biomolMatId1)
+            matrix = [biomolMat1, biomolMat2, biomolMat3]
+            biomolChains = [c for c in biomolChains if c]
+            if biomolNumber not in self.biomol:
+                self.biomol[biomolNumber] = list()
+            self.biomol[biomolNumber].append(dict(chains=biomolChains, matrix=matrix))
+
+    def setCalpha(self, chainOrder=None, required=True):
+        if chainOrder is None:
+            chainNames, firstIndices = np.unique(self.chainNames, return_index=True)
+            chainOrder = chainNames[np.argsort(firstIndices)].tolist()
+        calphaIndices = np.flatnonzero(np.char.strip(self.atomNames) == "CA")
+        calphaChains = self.chainNames[calphaIndices]
+        for chainName in chainOrder:
+            indices = calphaIndices[calphaChains == chainName]
+            if len(indices) > 0:
+                calphaIndex = dict(zip(self.residueNumbers[indices].tolist(), indices.tolist()))
+                self.calpha[chainName] = Chain(self, list(calphaIndex.keys()), list(calphaIndex.values()))
+        if required and not self.calpha:
             raise Exception("Molecule has no atoms.")
 
     def getFloats(self, nextLine):
@@ -86,40 +352,78 @@ class Molecule:
         matLine = list(map(lambda x: self.toFloat(x), matLine))
         return matId, matLine
 
-    def createUnit(self, biomolNumber=0):
+    def getValue(self, index, key):
+        if key in COORDINATES:
+            return float(self.coordinates[index, COORDINATES[key]])
+        if key in COLUMNS:
+            value = getattr(self, COLUMNS[key])[index].item()
+            if key == "residue" and value == "":
+                return None
+            return value
+        return self.attributes[key][index]
+
+    def setValue(self, index, key, value):
+        if key in COORDINATES:
+            self.coordinates[index, COORDINATES[key]] = value
+        elif key in COLUMNS:
+            columnName = COLUMNS[key]
+            column = getattr(self, columnName)
+            if key == "residue" and value is None:
+                value = ""
+            if column.dtype.kind == "U" and len(value) > column.dtype.itemsize // 4:
+                column = column.astype("U%d" % len(value))
+                setattr(self, columnName, column)
+            column[index] = value
+        else:
+            if key not in self.attributes:
+                self.attributes[key] = dict()
+            self.attributes[key][index] = value
+
+    def createUnit(self, biomolNumber=0, chains=None):
         if biomolNumber == 0:
             return self
         else:
             molecule = Molecule()
             chainCount = dict()
+            operators = list()
             for matrixDict in self.biomol[biomolNumber]:
+                unitChains = list()
                 for chain in matrixDict["chains"]:
                     if chain in self.calpha:
-                        chainCopy = dict()
-                        for residue in self.calpha[chain]:
-                            chainCopy[residue] = self.calpha[chain][residue].copy()
-                        for atomNumber in chainCopy:
-                            atom = chainCopy[atomNumber]
-                            rotmat = matrixDict["matrix"]
-                            self.applyMatrix(atom, rotmat)
                         if chain in chainCount:
-                            chainCount = chainCount[chain]
-                            chainName = "%s_%d" % (chain, chainCount)
-                            chainCount[chain] = chainCount + 1
+                            chainName = "%s_%d" % (chain, chainCount[chain])
+                            chainCount[chain] = chainCount[chain] + 1
                         else:
                             chainName = chain
                             chainCount[chain] = 0
-                        molecule.calpha[chainName] = chainCopy
+                        if chains is None or chainName in chains:
+                            unitChains.append((chainName, self.calpha[chain]))
+                if unitChains:
+                    operators.append((matrixDict["matrix"], unitChains))
+            chainCopies = [chainCopy for _, unitChains in operators for _, chainCopy in unitChains]
+            indices = np.concatenate([chainCopy.indices for chainCopy in chainCopies]) if chainCopies else np.zeros(0, dtype=np.int64)
+            molecule.setAtoms(self.coordinates[indices], self.atomNumbers[indices], self.atomNames[indices],
+                              self.residues[indices], self.residueNumbers[indices], self.chainNames[indices],
+                              self.occupancies[indices], self.temperatures[indices])
+            start = 0
+            for rotmat, unitChains in operators:
+                size = sum([len(chainCopy) for _, chainCopy in unitChains])
+                molecule.transform(rotmat, slice(start, start + size))
+                for chainName, chainCopy in unitChains:
+                    molecule.calpha[chainName] = Chain(molecule, chainCopy.residueNumbers, np.arange(start, start + len(chainCopy)))
+                    start = start + len(chainCopy)
             return molecule
 
     def getSequence(self, chainName):
-        seq = ""
         if chainName not in self.calpha:
             raise Exception("Chain identifier not found [%s]" % chainName)
-        chainDict = self.calpha[chainName]
-        for residueNumber in sorted(chainDict):
-            seq = seq + self.toSingleAmino(chainDict[residueNumber]["residue"])
-        return seq
+        chain = self.calpha[chainName]
+        order = np.argsort(chain.residueNumbers, kind="stable")
+        residues = self.residues[chain.indices[order]].tolist()
+        return "".join([self.toSingleAmino(residue if residue else None) for residue in residues])
+
+    def getCoordinates(self, chainName):
+        return self.calpha[chainName].getCoordinates()
 
     def applyMatrix(self, atom, rotmat):
         newx = atom["x"] * rotmat[0][0] + atom["y"] * rotmat[0][1] + atom["z"] * rotmat[0][2] + rotmat[0][3]
@@ -130,6 +434,19 @@ class Molecule:
         atom["z"] = newz
         return atom
 
+    def transform(self, rotmat, indices=None):
+        if indices is None:
+            indices = slice(None)
+        x = self.coordinates[indices, 0]
+        y = self.coordinates[indices, 1]
+        z = self.coordinates[indices, 2]
+        newx = x * rotmat[0][0] + y * rotmat[0][1] + z * rotmat[0][2] + rotmat[0][3]
+        newy = x * rotmat[1][0] + y * rotmat[1][1] + z * rotmat[1][2] + rotmat[1][3]
+        newz = x * rotmat[2][0] + y * rotmat[2][1] + z * rotmat[2][2] + rotmat[2][3]
+        self.coordinates[indices, 0] = newx
+        self.coordinates[indices, 1] = newy
+        self.coordinates[indices, 2] = newz
+
     def toFloat(self, x, optional=False):
         try:
             return float(x)
@@ -151,7 +468,7 @@ class Molecule:
 
     def saveChain(self, chainName, outputName):
         f = open(outputName, "w")
-        for residueNumber in sorted(self.calpha[chainName].keys()):  
+        for residueNumber in sorted(self.calpha[chainName].keys()):
             ca = self.calpha[chainName][residueNumber]
             if ca["residue"] is not None:
                 f.write(self.atomString(ca))
@@ -162,8 +479,9 @@ class Molecule:
         f = open(outputName, fileFlag)
         if payload:
             f.write("%s\n" % payload)
+        if chainName:
+            self.chainNames = np.full(len(self.coordinates), chainName)
         for atom in self.atoms:
-            atom["chainName"] = chainName if chainName else atom["chainName"]
             f.write(self.atomString(atom))
         f.write("TER\n")
         f.close()
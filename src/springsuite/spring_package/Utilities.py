@@ -50,19 +50,47 @@ def getCrossReference(crossReferenceFile, allPartners=False):
     return crossReference
 
 
-def getTemplates(hhrFile, minScore=10):
-    result = dict()
-    topTemplate = None
+def getInterfaceIndex(interfaceIndexFile):
+    interfaceIndex = dict()
+    interfaceCount = 0
+    with open(interfaceIndexFile) as file:
+        for line in file:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) != 8:
+                raise Exception("Invalid Interface Index Entry %s." % line)
+            key = (columns[0], columns[1])
+            if key not in interfaceIndex:
+                interfaceIndex[key] = list()
+            interfaceIndex[key].append(dict(biomol=int(columns[2]), coreChain=columns[3], partnerChain=columns[4], contacts=int(columns[5]),
+                                            coreResidues=set(map(int, filter(None, columns[6].split(",")))),
+                                            partnerResidues=set(map(int, filter(None, columns[7].split(","))))))
+            interfaceCount = interfaceCount + 1
+    print("Identified %s indexed interfaces." % interfaceCount)
+    return interfaceIndex
+
+
+def getTemplates(hhrFile, minScore=10, content=None):
+    if content is not None:
+        if isinstance(content, bytes):
+            content = content.decode()
+        return getTemplateLines(content.splitlines(), minScore)
     if isfile(hhrFile):
         with open(hhrFile) as file:
-            for index, line in enumerate(file):
-                if index > 8:
-                    if not line.strip():
-                        break
-                    templateId = line[4:10]
-                    templateScore = float(line[57:63])
-                    if templateScore > minScore:
-                        if topTemplate is None:
-                            topTemplate = templateId
-                        result[templateId] = templateScore
+            return getTemplateLines(file, minScore)
+    return None, dict()
+
+
+def getTemplateLines(lines, minScore=10):
+    result = dict()
+    topTemplate = None
+    for index, line in enumerate(lines):
+        if index > 8:
+            if not line.strip():
+                break
+            templateId = line[4:10]
+            templateScore = float(line[57:63])
+            if templateScore > minScore:
+                if topTemplate is None:
+                    topTemplate = templateId
+                result[templateId] = templateScore
     return topTemplate, result